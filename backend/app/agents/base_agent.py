@@ -2,7 +2,7 @@
 Base Agent for BioThings Executive AI
 Clean, simplified implementation
 """
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Callable, Optional, List
 from datetime import datetime
 from abc import ABC, abstractmethod
 from app.core.llm import llm_service
@@ -17,6 +17,8 @@ class BaseAgent(ABC):
         self.agent_type = agent_type
         self.system_prompt = self._get_system_prompt()
         self.active_tasks = []
+        # Called with the agent whenever get_status() would change
+        self.status_listeners: List[Callable[["BaseAgent"], None]] = []
         
     @abstractmethod
     def _get_system_prompt(self) -> str:
@@ -59,6 +61,7 @@ Be specific and actionable in your response.
                 "context": context
             }
             self.active_tasks.append(task_record)
+            self._notify_status_changed()
             
             # Broadcast update
             if message_broker:
@@ -151,7 +154,13 @@ Make it clear, actionable, and professional.
             "last_task": self.active_tasks[-1] if self.active_tasks else None
         }
     
+    def _notify_status_changed(self):
+        """Tell status listeners that get_status() has changed"""
+        for listener in self.status_listeners:
+            listener(self)
+    
     def clear_history(self):
         """Clear task history"""
         self.active_tasks = []
-        llm_service.clear_history(self.agent_id)
\ No newline at end of file
+        llm_service.clear_history(self.agent_id)
+        self._notify_status_changed()
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""
+Bounded in-memory buffer drained in batches by a background task
+"""
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional
+import structlog
+
+logger = structlog.get_logger()
+
+
+class BatchBuffer:
+    """Handoff buffer between request handlers and one background consumer.
+    
+    Producers never block: ``put`` returns False and counts the item as
+    dropped when the consumer is not running or the buffer is full. The
+    consumer hands up to ``batch_size`` items at a time to ``handler``,
+    either as soon as an item arrives or, when ``flush_interval`` is set,
+    once a batch fills up or the interval passes.
+    
+    ``stop`` signals the consumer and waits for it to finish, so batches
+    already taken from the buffer are never abandoned mid-way; whatever is
+    still buffered is handled before it returns.
+    """
+    
+    def __init__(self,
+                 handler: Callable[[List[Any]], Awaitable[None]],
+                 max_size: int,
+                 batch_size: int,
+                 flush_interval: Optional[float] = None,
+                 name: str = "batch buffer"):
+        self.handler = handler
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self.items: deque = deque()
+        self.dropped = 0
+        self._running = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def __len__(self) -> int:
+        return len(self.items)
+    
+    @property
+    def is_running(self) -> bool:
+        """Whether the consumer is accepting items"""
+        return self._running
+    
+    @property
+    def is_full(self) -> bool:
+        return len(self.items) >= self.max_size
+    
+    def put(self, item: Any, urgent: bool = False) -> bool:
+        """Queue an item for the consumer; ``urgent`` flushes without waiting for a full batch"""
+        if not self._running or len(self.items) >= self.max_size:
+            self.dropped += 1
+            return False
+        
+        self.items.append(item)
+        if urgent or self.flush_interval is None or len(self.items) >= self.batch_size:
+            self._wakeup.set()
+        return True
+    
+    async def start(self) -> None:
+        """Start the background consumer"""
+        if self._task is not None:
+            return
+        
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop accepting items and wait for the consumer to handle the rest"""
+        task = self._task
+        if task is None:
+            return
+        
+        self._running = False
+        self._wakeup.set()
+        await asyncio.gather(task, return_exceptions=True)
+        self._task = None
+        
+        # Batches put back by a consumer that was cancelled instead of stopped
+        await self.flush()
+    
+    async def flush(self) -> int:
+        """Hand every buffered item to the handler, one batch at a time"""
+        items = self.items
+        handled = 0
+        while items:
+            batch = [items.popleft() for _ in range(min(self.batch_size, len(items)))]
+            try:
+                await self.handler(batch)
+            except asyncio.CancelledError:
+                # Put the batch back so a later flush still sees it
+                items.extendleft(reversed(batch))
+                raise
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.error(f"{self.name} batch failed", error=str(e), count=len(batch))
+            else:
+                handled += len(batch)
+        return handled
+    
+    async def _run(self) -> None:
+        """Flush whenever woken (or every flush_interval) until stopped, then drain"""
+        while self._running:
+            if self.flush_interval is None:
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush()
+        
+        await self.flush()
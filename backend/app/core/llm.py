@@ -3,6 +3,7 @@ Google Gemini 2.5 LLM Service
 Clean, production-ready implementation
 """
 import os
+import asyncio
 from typing import Dict, List, Optional
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
@@ -28,6 +29,11 @@ class LLMService:
             max_output_tokens=8192,
         )
         
+        # All callers share the client above; cap in-flight requests so bursts
+        # queue here instead of exhausting upstream connections and quota
+        self.max_concurrency = int(os.getenv("LLM_CONCURRENCY", "16"))
+        self._concurrency = asyncio.Semaphore(self.max_concurrency)
+        
         # Conversation memory (limited to prevent memory bloat)
         self.conversations: Dict[str, List] = {}
         self.max_history = 20  # Keep last 20 messages per agent
@@ -69,10 +75,12 @@ class LLMService:
                         "thinking_budget": self.thinking_budget
                     }
                 }
-                response = await self.llm.ainvoke(messages, config=config)
+                async with self._concurrency:
+                    response = await self.llm.ainvoke(messages, config=config)
             else:
                 # Fast mode for simple queries
-                response = await self.llm.ainvoke(messages)
+                async with self._concurrency:
+                    response = await self.llm.ainvoke(messages)
             
             # Store in history
             self.conversations[agent_id].extend([
@@ -3,13 +3,15 @@ Real-time Messaging System with Redis Pub/Sub
 """
 import json
 import asyncio
-from typing import Dict, Any, Callable, List, Optional
+from typing import Dict, Any, Callable, List, Optional, Sequence, Tuple
 from datetime import datetime
 import redis.asyncio as redis
 from redis.asyncio.client import PubSub
 import structlog
 from pydantic import BaseModel
 
+from app.core.batching import BatchBuffer
+
 logger = structlog.get_logger()
 
 
@@ -34,6 +36,20 @@ class MessageBroker:
         self.subscriptions: Dict[str, List[Callable]] = {}
         self._listener_task: Optional[asyncio.Task] = None
         self._connected = False
+        
+        # Messages queued from request handlers are published in batches by a
+        # background task; when the buffer is full new messages are dropped
+        self.pending_messages = BatchBuffer(
+            self.publish_many,
+            max_size=5000,
+            batch_size=64,
+            name="Message publisher"
+        )
+    
+    @property
+    def is_connected(self) -> bool:
+        """Whether the broker currently has a Redis connection"""
+        return self._connected
     
     async def connect(self):
         """Connect to Redis"""
@@ -73,34 +89,97 @@ class MessageBroker:
     
     async def publish(self, channel: str, data: Dict[str, Any], sender: str = "system") -> str:
         """Publish message to a channel"""
+        message = self._build_message(channel, data, sender)
+        
+        # Encode once; the same body is published and stored in history
+        await self.publish_raw(channel, message.model_dump_json())
+        
+        logger.debug(f"Published message to {channel}", message_id=message.id)
+        return message.id
+    
+    async def publish_raw(self, channel: str, body: str):
+        """Publish an already encoded Message envelope to a channel"""
         if not self._connected:
             await self.connect()
         
-        message = Message(
-            id=f"msg-{datetime.utcnow().timestamp()}",
-            channel=channel,
-            type=data.get("type", "generic"),
-            sender=sender,
-            data=data,
-            timestamp=datetime.utcnow()
-        )
-        
         try:
-            await self.redis_client.publish(
-                channel,
-                message.model_dump_json()
-            )
+            await self.redis_client.publish(channel, body)
             
             # Store message in history
-            await self._store_message(message)
-            
-            logger.debug(f"Published message to {channel}", message_id=message.id)
-            return message.id
+            await self._store_message(channel, body)
             
         except Exception as e:
             logger.error(f"Failed to publish message: {e}", channel=channel)
             raise
     
+    async def publish_many(self, items: Sequence[Tuple[str, Dict[str, Any], str]]) -> List[str]:
+        """Publish (channel, data, sender) messages in a single pipelined round trip"""
+        if not self._connected:
+            await self.connect()
+        
+        messages = [self._build_message(channel, data, sender) for channel, data, sender in items]
+        
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            channels = set()
+            for message in messages:
+                body = message.model_dump_json()
+                pipe.publish(message.channel, body)
+                pipe.lpush(f"message_history:{message.channel}", body)
+                channels.add(message.channel)
+            
+            # Trim and refresh each history list once per batch
+            for channel in channels:
+                key = f"message_history:{channel}"
+                pipe.ltrim(key, 0, 999)
+                pipe.expire(key, 86400)
+            
+            await pipe.execute()
+        
+        logger.debug("Published message batch", count=len(messages))
+        return [message.id for message in messages]
+    
+    def enqueue(self, channel: str, data: Dict[str, Any], sender: str = "system") -> bool:
+        """Queue a message for the background publisher without blocking the caller.
+        
+        Returns False if the message was dropped because the publisher is not
+        running or the buffer is full.
+        """
+        return self.pending_messages.put((channel, data, sender))
+    
+    @property
+    def dropped_messages(self) -> int:
+        """Messages not published: rejected by enqueue or lost in a failed batch"""
+        return self.pending_messages.dropped
+    
+    async def start_publisher(self):
+        """Start the background publisher for queued messages"""
+        if self.pending_messages.is_running:
+            return
+        
+        await self.pending_messages.start()
+        
+        logger.info("Message publisher started")
+    
+    async def stop_publisher(self):
+        """Stop the background publisher once every queued message is published"""
+        if not self.pending_messages.is_running:
+            return
+        
+        await self.pending_messages.stop()
+        
+        logger.info("Message publisher stopped", dropped_messages=self.dropped_messages)
+    
+    def _build_message(self, channel: str, data: Dict[str, Any], sender: str) -> Message:
+        """Wrap message data in the standard envelope"""
+        return Message(
+            id=f"msg-{datetime.utcnow().timestamp()}",
+            channel=channel,
+            type=data.get("type", "generic"),
+            sender=sender,
+            data=data,
+            timestamp=datetime.utcnow()
+        )
+    
     async def subscribe(self, channel: str, callback: Callable):
         """Subscribe to a channel"""
         if channel not in self.subscriptions:
@@ -159,14 +238,16 @@ class MessageBroker:
         except Exception as e:
             logger.error(f"Failed to handle message: {e}")
     
-    async def _store_message(self, message: Message):
-        """Store message in history"""
+    async def _store_message(self, channel: str, body: str):
+        """Store an encoded message in history"""
         try:
-            # Store in Redis list with TTL
-            key = f"message_history:{message.channel}"
-            await self.redis_client.lpush(key, message.model_dump_json())
-            await self.redis_client.ltrim(key, 0, 999)  # Keep last 1000 messages
-            await self.redis_client.expire(key, 86400)  # 24 hour TTL
+            # Store in Redis list with TTL, in one round trip
+            key = f"message_history:{channel}"
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.lpush(key, body)
+                pipe.ltrim(key, 0, 999)  # Keep last 1000 messages
+                pipe.expire(key, 86400)  # 24 hour TTL
+                await pipe.execute()
             
         except Exception as e:
             logger.error(f"Failed to store message: {e}")
@@ -83,7 +83,7 @@ async def lifespan(app: FastAPI):
     agents["COO"] = COOAgent()
     
     # Subscribe to WebSocket broadcast channel if message broker is available
-    if message_broker._connected:
+    if message_broker.is_connected:
         async def websocket_broadcast_handler(message):
             await manager.broadcast(message.data)
         
@@ -95,7 +95,7 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down BioThings application...")
-    if message_broker._connected:
+    if message_broker.is_connected:
         await message_broker.disconnect()
     logger.info("BioThings application shut down")
 
@@ -169,12 +169,7 @@ async def assign_task(agent_type: str, task_data: Dict[str, Any]):
 @app.get("/api/experiments")
 async def get_experiments():
     """Get all active experiments"""
-    return {
-        "experiments": [
-            await workflow_engine.get_experiment_status(exp_id)
-            for exp_id in workflow_engine.active_experiments.keys()
-        ]
-    }
+    return {"experiments": await workflow_engine.get_experiment_statuses()}
 
 
 @app.post("/api/experiments/start")
@@ -244,7 +239,7 @@ async def get_current_metrics():
     """Get current monitoring metrics"""
     return {
         "metrics": {
-            "experiments_active": len(workflow_engine.active_experiments),
+            "experiments_active": workflow_engine.active_count,
             "agents_online": len(agents),
             "system_uptime": "100%",
             "api_response_time": "150ms"
@@ -382,10 +377,10 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
         "services": {
-            "message_broker": message_broker._connected,
+            "message_broker": message_broker.is_connected,
             "llm_service": bool(llm_service.llm),
             "agents": len(agents),
-            "active_experiments": len(workflow_engine.active_experiments)
+            "active_experiments": workflow_engine.active_count
         }
     }
 
@@ -292,8 +292,22 @@ class BiotechWorkflowEngine:
         if experiment_id not in self.active_experiments:
             return {"error": "Experiment not found"}
         
-        experiment = self.active_experiments[experiment_id]
-        
+        return self._experiment_status(self.active_experiments[experiment_id])
+    
+    @property
+    def active_count(self) -> int:
+        """Number of tracked experiments"""
+        return len(self.active_experiments)
+    
+    async def get_experiment_statuses(self) -> List[Dict[str, Any]]:
+        """Get current status of all active experiments in one pass"""
+        return [
+            self._experiment_status(experiment)
+            for experiment in tuple(self.active_experiments.values())
+        ]
+    
+    def _experiment_status(self, experiment: ExperimentRun) -> Dict[str, Any]:
+        """Build the status payload for an experiment"""
         return {
             "id": experiment.id,
             "protocol": experiment.protocol.name,
@@ -11,6 +11,9 @@ from .production_security import (
     UserRole,
     SecurityLevel,
     security_manager,
+    ClientInfo,
+    get_client_info,
+    request_client_info,
     get_current_user,
     require_admin,
     require_scientist
@@ -28,7 +31,6 @@ from .validation_middleware import (
 from .config import (
     SecurityConfigManager,
     Environment,
-    security_config,
     get_security_config
 )
 
@@ -51,6 +53,8 @@ from .database_models import (
     get_database
 )
 
+from .pipeline_middleware import SecurityPipelineMiddleware
+
 from .monitoring import (
     SecurityMonitor,
     security_monitor,
@@ -73,6 +77,9 @@ __all__ = [
     'UserRole',
     'SecurityLevel',
     'security_manager',
+    'ClientInfo',
+    'get_client_info',
+    'request_client_info',
     'get_current_user',
     'require_admin',
     'require_scientist',
@@ -100,6 +107,9 @@ __all__ = [
     'EventCategory',
     'audit_logger',
     
+    # Combined middleware
+    'SecurityPipelineMiddleware',
+    
     # Database
     'UserModel',
     'UserSession',
@@ -121,4 +131,12 @@ __all__ = [
     'create_app'
 ]
 
-__version__ = "1.0.0"
\ No newline at end of file
+__version__ = "1.0.0"
+
+
+# security_config is built on first access (see security.config.__getattr__)
+def __getattr__(name: str):
+    if name == "security_config":
+        from . import config
+        return getattr(config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -4,20 +4,28 @@ Provides detailed security event logging, monitoring, and compliance reporting
 """
 import json
 import asyncio
+import os
+import sys
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Sequence, Union
 from dataclasses import dataclass, asdict
 from enum import Enum
 from pathlib import Path
 import hashlib
+import heapq
 import gzip
 import csv
-from collections import defaultdict
+import io
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import Request
-from fastapi.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
 import structlog
 import aiofiles
 
+from app.core.batching import BatchBuffer
+from .production_security import request_client_info
+
 logger = structlog.get_logger()
 
 
@@ -88,6 +96,8 @@ class AuditEvent:
     response_size: Optional[int] = None
     
     def __post_init__(self):
+        # Share one str object per distinct value across retained events
+        self.event_type = sys.intern(self.event_type)
         if self.details is None:
             self.details = {}
         if self.compliance_tags is None:
@@ -105,8 +115,12 @@ class AuditEvent:
     
     def get_event_hash(self) -> str:
         """Generate hash for event integrity"""
-        event_str = f"{self.timestamp.isoformat()}{self.event_type}{self.user_id}{self.client_ip}"
-        return hashlib.sha256(event_str.encode()).hexdigest()[:16]
+        hasher = hashlib.blake2b(digest_size=8)
+        hasher.update(self.timestamp.isoformat().encode())
+        hasher.update(self.event_type.encode())
+        hasher.update((self.user_id or "").encode())
+        hasher.update(self.client_ip.encode())
+        return hasher.hexdigest()
 
 
 class AuditLogger:
@@ -117,7 +131,9 @@ class AuditLogger:
                  max_file_size_mb: int = 100,
                  retention_days: int = 90,
                  compression_enabled: bool = True,
-                 real_time_alerts: bool = True):
+                 real_time_alerts: bool = True,
+                 max_pending_events: int = 10000,
+                 flush_batch_size: int = 256):
         
         self.log_directory = Path(log_directory)
         self.log_directory.mkdir(parents=True, exist_ok=True)
@@ -135,6 +151,7 @@ class AuditLogger:
         self.event_counts = defaultdict(int)
         self.severity_counts = defaultdict(int)
         self.user_activity = defaultdict(int)
+        self.max_tracked_keys = 10000
         
         # Alert thresholds
         self.alert_thresholds = {
@@ -147,80 +164,140 @@ class AuditLogger:
         # Current log file
         self.current_log_file = None
         self.current_file_size = 0
+        self._current_bucket: Optional[int] = None
+        
+        # Handoff buffer between request handlers and the background flush task.
+        # Producers never block: when the buffer is full new events are dropped
+        # and counted instead.
+        self.pending_events = BatchBuffer(
+            self.log_events,
+            max_size=max_pending_events,
+            batch_size=flush_batch_size,
+            name="Audit flush"
+        )
         
         logger.info("Audit logger initialized", directory=str(self.log_directory))
     
+    @property
+    def is_running(self) -> bool:
+        """Whether the background flush task is accepting events"""
+        return self.pending_events.is_running
+    
+    @property
+    def dropped_events(self) -> int:
+        return self.pending_events.dropped
+    
+    async def start(self) -> None:
+        """Start the background flush task"""
+        if self.is_running:
+            return
+        
+        await self.pending_events.start()
+        
+        logger.info("Audit logger flush task started")
+    
+    async def stop(self) -> None:
+        """Stop the background flush task once every pending event is written"""
+        if not self.is_running:
+            return
+        
+        await self.pending_events.stop()
+        
+        logger.info("Audit logger flush task stopped", dropped_events=self.dropped_events)
+    
+    def enqueue_event(self, event: AuditEvent) -> bool:
+        """Hand an event to the flush task without blocking the caller.
+        
+        Returns False if the event was dropped because the flush task is not
+        running or the buffer is full.
+        """
+        return self.pending_events.put(event)
+    
     async def log_event(self, event: AuditEvent) -> None:
         """Log an audit event"""
+        await self.log_events((event,))
+    
+    async def log_events(self, events: Sequence[AuditEvent]) -> None:
+        """Log a batch of audit events with a single log file write"""
         try:
             # Add to recent events
-            self.recent_events.append(event)
-            if len(self.recent_events) > self.max_recent_events:
-                self.recent_events.pop(0)
+            self.recent_events.extend(events)
+            overflow = len(self.recent_events) - self.max_recent_events
+            if overflow > 0:
+                del self.recent_events[:overflow]
             
             # Update statistics
-            self.event_counts[event.event_type] += 1
-            self.severity_counts[event.severity] += 1
-            if event.user_id:
-                self.user_activity[event.user_id] += 1
+            for event in events:
+                self.event_counts[event.event_type] += 1
+                self.severity_counts[event.severity] += 1
+                if event.user_id:
+                    self.user_activity[event.user_id] += 1
             
-            # Write to file
-            await self._write_to_file(event)
+            # Keep the all-time counters bounded in long-running processes
+            if len(self.user_activity) > self.max_tracked_keys:
+                self._evict_least_active(self.user_activity)
+            if len(self.event_counts) > self.max_tracked_keys:
+                self._evict_least_active(self.event_counts)
             
-            # Check for real-time alerts
-            if self.real_time_alerts:
-                await self._check_alerts(event)
+            # Write to file
+            await self._write_to_file(events)
             
-            # Log to structured logger
-            logger.bind(
-                event_id=event.event_id,
-                event_type=event.event_type,
-                category=event.category,
-                severity=event.severity,
-                user_id=event.user_id,
-                client_ip=event.client_ip
-            ).info("Audit event logged", message=event.message)
+            for event in events:
+                # Check for real-time alerts
+                if self.real_time_alerts:
+                    await self._check_alerts(event)
+                
+                # Log to structured logger
+                logger.info(
+                    "Audit event logged",
+                    event_id=event.event_id,
+                    event_type=event.event_type,
+                    category=event.category,
+                    severity=event.severity,
+                    user_id=event.user_id,
+                    client_ip=event.client_ip,
+                    message=event.message
+                )
             
         except Exception as e:
-            logger.error("Failed to log audit event", error=str(e), event_type=event.event_type)
+            logger.error("Failed to log audit events", error=str(e), count=len(events))
     
-    async def _write_to_file(self, event: AuditEvent) -> None:
-        """Write event to log file"""
+    def _evict_least_active(self, counts: Dict[str, int]) -> None:
+        """Drop the least frequent keys, keeping the busiest half"""
+        busiest = heapq.nlargest(self.max_tracked_keys // 2, counts.items(), key=lambda item: item[1])
+        counts.clear()
+        counts.update(busiest)
+    
+    async def _write_to_file(self, events: Sequence[AuditEvent]) -> None:
+        """Append events to the current log file"""
         # Check if we need a new log file
         if self._need_new_log_file():
             await self._rotate_log_file()
         
-        # Ensure current log file exists
-        if not self.current_log_file:
-            self.current_log_file = self._get_current_log_filename()
-        
-        # Write event to file
-        log_line = event.to_json() + '\n'
+        # Write all events at once
+        log_lines = ''.join([event.to_json() + '\n' for event in events])
         
         async with aiofiles.open(self.current_log_file, 'a') as f:
-            await f.write(log_line)
+            await f.write(log_lines)
         
-        self.current_file_size += len(log_line.encode())
+        # to_json() escapes non-ASCII characters, so the character count is the byte count
+        self.current_file_size += len(log_lines)
+    
+    @staticmethod
+    def _hour_bucket(dt: datetime) -> int:
+        """Hour bucket of a timestamp as an integer, e.g. 2024010215"""
+        return ((dt.year * 100 + dt.month) * 100 + dt.day) * 100 + dt.hour
     
     def _need_new_log_file(self) -> bool:
         """Check if we need to create a new log file"""
         if not self.current_log_file:
             return True
         
-        if not Path(self.current_log_file).exists():
-            return True
-        
         if self.current_file_size >= self.max_file_size:
             return True
         
-        # Check if it's a new day
-        if self.current_log_file:
-            file_date = self._extract_date_from_filename(self.current_log_file)
-            today = datetime.now().strftime('%Y-%m-%d')
-            if file_date != today:
-                return True
-        
-        return False
+        # Log files are hourly
+        return self._hour_bucket(datetime.now()) != self._current_bucket
     
     async def _rotate_log_file(self) -> None:
         """Rotate log file"""
@@ -229,7 +306,9 @@ class AuditLogger:
             await self._compress_log_file(self.current_log_file)
         
         # Create new log file
-        self.current_log_file = self._get_current_log_filename()
+        now = datetime.now()
+        self.current_log_file = self._get_current_log_filename(now)
+        self._current_bucket = self._hour_bucket(now)
         self.current_file_size = 0
         
         logger.info("Log file rotated", new_file=self.current_log_file)
@@ -253,24 +332,46 @@ class AuditLogger:
         except Exception as e:
             logger.error("Failed to compress log file", filename=filename, error=str(e))
     
-    def _get_current_log_filename(self) -> str:
+    def _get_current_log_filename(self, now: Optional[datetime] = None) -> str:
         """Get current log filename"""
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H')
+        timestamp = (now or datetime.now()).strftime('%Y-%m-%d_%H')
         return str(self.log_directory / f"audit-{timestamp}.jsonl")
     
-    def _extract_date_from_filename(self, filename: str) -> str:
-        """Extract date from log filename"""
+    @staticmethod
+    def _parse_log_file_date(filename: str) -> Optional[datetime]:
+        """Parse the hour from an "audit-YYYY-MM-DD_HH.jsonl[.gz]" filename"""
+        prefix = "audit-"
+        if not filename.startswith(prefix):
+            return None
         try:
-            basename = Path(filename).name
-            # Extract date part from "audit-YYYY-MM-DD_HH.jsonl"
-            date_part = basename.split('-')[1:4]  # ['YYYY', 'MM', 'DD_HH.jsonl']
-            date_part[2] = date_part[2].split('_')[0]  # Remove hour part
-            return '-'.join(date_part)
-        except:
-            return datetime.now().strftime('%Y-%m-%d')
+            return datetime.strptime(filename[len(prefix):len(prefix) + 13], '%Y-%m-%d_%H')
+        except ValueError:
+            return None
     
     async def _check_alerts(self, event: AuditEvent) -> None:
         """Check for security alerts based on event patterns"""
+        # Alerts never re-trigger alert checks
+        if event.event_type == "security_alert":
+            return
+        
+        # Only evaluate the checks whose counters this event contributes to.
+        # Every event with a client IP counts towards per-IP activity; the
+        # other counters only see failures and critical events
+        checks = []
+        if event.client_ip:
+            checks.append(self._check_suspicious_ip)
+        if not (event.success
+                and event.severity in (EventSeverity.DEBUG, EventSeverity.INFO)
+                and event.event_type != "login_failed"):
+            if event.event_type == "login_failed":
+                checks.append(self._check_failed_logins)
+            if event.severity == EventSeverity.CRITICAL:
+                checks.append(self._check_critical_events)
+            if not event.success and event.category == EventCategory.API_ACCESS:
+                checks.append(self._check_api_errors)
+        if not checks:
+            return
+        
         current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
         hour_ago = current_hour - timedelta(hours=1)
         
@@ -280,64 +381,50 @@ class AuditLogger:
             if e.timestamp >= hour_ago
         ]
         
-        alerts = []
-        
-        # Check failed login attempts
-        failed_logins = [
-            e for e in recent_hour_events 
-            if e.event_type == "login_failed"
-        ]
-        if len(failed_logins) >= self.alert_thresholds["failed_logins_per_hour"]:
-            alerts.append({
-                "type": "excessive_failed_logins",
-                "count": len(failed_logins),
-                "threshold": self.alert_thresholds["failed_logins_per_hour"]
-            })
-        
-        # Check critical events
-        critical_events = [
-            e for e in recent_hour_events 
-            if e.severity == EventSeverity.CRITICAL
-        ]
-        if len(critical_events) >= self.alert_thresholds["critical_events_per_hour"]:
-            alerts.append({
-                "type": "excessive_critical_events",
-                "count": len(critical_events),
-                "threshold": self.alert_thresholds["critical_events_per_hour"]
-            })
-        
-        # Check API errors
-        api_errors = [
-            e for e in recent_hour_events 
+        for check in checks:
+            alert = check(event, recent_hour_events)
+            if alert:
+                await self._send_alert(alert, event)
+    
+    def _check_failed_logins(self, event: AuditEvent,
+                             recent_hour_events: List[AuditEvent]) -> Optional[Dict[str, Any]]:
+        """Check failed login attempts"""
+        threshold = self.alert_thresholds["failed_logins_per_hour"]
+        count = sum(1 for e in recent_hour_events if e.event_type == "login_failed")
+        if count >= threshold:
+            return {"type": "excessive_failed_logins", "count": count, "threshold": threshold}
+        return None
+    
+    def _check_critical_events(self, event: AuditEvent,
+                               recent_hour_events: List[AuditEvent]) -> Optional[Dict[str, Any]]:
+        """Check critical events"""
+        threshold = self.alert_thresholds["critical_events_per_hour"]
+        count = sum(1 for e in recent_hour_events if e.severity == EventSeverity.CRITICAL)
+        if count >= threshold:
+            return {"type": "excessive_critical_events", "count": count, "threshold": threshold}
+        return None
+    
+    def _check_api_errors(self, event: AuditEvent,
+                          recent_hour_events: List[AuditEvent]) -> Optional[Dict[str, Any]]:
+        """Check API errors"""
+        threshold = self.alert_thresholds["api_errors_per_hour"]
+        count = sum(
+            1 for e in recent_hour_events
             if not e.success and e.category == EventCategory.API_ACCESS
-        ]
-        if len(api_errors) >= self.alert_thresholds["api_errors_per_hour"]:
-            alerts.append({
-                "type": "excessive_api_errors",
-                "count": len(api_errors),
-                "threshold": self.alert_thresholds["api_errors_per_hour"]
-            })
-        
-        # Check for suspicious IP activity
-        ip_counts = defaultdict(int)
-        for e in recent_hour_events:
-            if e.client_ip:
-                ip_counts[e.client_ip] += 1
-        
-        suspicious_ips = [
-            ip for ip, count in ip_counts.items() 
-            if count >= self.alert_thresholds["suspicious_ips_per_hour"]
-        ]
-        if suspicious_ips:
-            alerts.append({
-                "type": "suspicious_ip_activity",
-                "ips": suspicious_ips,
-                "threshold": self.alert_thresholds["suspicious_ips_per_hour"]
-            })
-        
-        # Send alerts
-        for alert in alerts:
-            await self._send_alert(alert, event)
+        )
+        if count >= threshold:
+            return {"type": "excessive_api_errors", "count": count, "threshold": threshold}
+        return None
+    
+    def _check_suspicious_ip(self, event: AuditEvent,
+                             recent_hour_events: List[AuditEvent]) -> Optional[Dict[str, Any]]:
+        """Check activity from the triggering event's IP"""
+        threshold = self.alert_thresholds["suspicious_ips_per_hour"]
+        client_ip = event.client_ip
+        count = sum(1 for e in recent_hour_events if e.client_ip == client_ip)
+        if count >= threshold:
+            return {"type": "suspicious_ip_activity", "ips": [client_ip], "threshold": threshold}
+        return None
     
     async def _send_alert(self, alert: Dict[str, Any], triggering_event: AuditEvent) -> None:
         """Send security alert"""
@@ -376,34 +463,32 @@ class AuditLogger:
                           limit: int = 1000) -> List[AuditEvent]:
         """Query audit events with filters"""
         
-        # Start with recent events in memory
-        events = self.recent_events.copy()
-        
-        # Apply filters
+        # Collect only the active filters so each event is tested once
+        predicates = []
         if start_time:
-            events = [e for e in events if e.timestamp >= start_time]
-        
+            predicates.append(lambda e: e.timestamp >= start_time)
         if end_time:
-            events = [e for e in events if e.timestamp <= end_time]
-        
+            predicates.append(lambda e: e.timestamp <= end_time)
         if event_types:
-            events = [e for e in events if e.event_type in event_types]
-        
+            predicates.append(lambda e: e.event_type in event_types)
         if user_id:
-            events = [e for e in events if e.user_id == user_id]
-        
+            predicates.append(lambda e: e.user_id == user_id)
         if client_ip:
-            events = [e for e in events if e.client_ip == client_ip]
-        
+            predicates.append(lambda e: e.client_ip == client_ip)
         if severity:
-            events = [e for e in events if e.severity == severity]
-        
+            predicates.append(lambda e: e.severity == severity)
         if category:
-            events = [e for e in events if e.category == category]
+            predicates.append(lambda e: e.category == category)
         
-        # Sort by timestamp (newest first) and limit
-        events.sort(key=lambda x: x.timestamp, reverse=True)
-        return events[:limit]
+        if not predicates:
+            matches = iter(self.recent_events)
+        elif len(predicates) == 1:
+            matches = filter(predicates[0], self.recent_events)
+        else:
+            matches = (e for e in self.recent_events if all(p(e) for p in predicates))
+        
+        # Newest first, keeping only `limit` events in memory
+        return heapq.nlargest(limit, matches, key=lambda e: e.timestamp)
     
     async def generate_compliance_report(self,
                                        start_date: datetime,
@@ -413,6 +498,31 @@ class AuditLogger:
         
         events = await self.query_events(start_time=start_date, end_time=end_date)
         
+        # Aggregate every dimension in a single pass over the events
+        severity_counts = Counter()
+        category_counts = Counter()
+        users = set()
+        ips = set()
+        auth_failures = 0
+        privilege_escalations = 0
+        data_access_events = 0
+        admin_actions = 0
+        for event in events:
+            severity_counts[event.severity.value] += 1
+            category_counts[event.category.value] += 1
+            if event.user_id:
+                users.add(event.user_id)
+            if event.client_ip:
+                ips.add(event.client_ip)
+            if "login_failed" in event.event_type:
+                auth_failures += 1
+            if "privilege" in event.event_type:
+                privilege_escalations += 1
+            if event.sensitive_data_accessed:
+                data_access_events += 1
+            if event.category == EventCategory.SYSTEM_ADMIN:
+                admin_actions += 1
+        
         # Analyze events for compliance
         report_data = {
             "report_period": {
@@ -421,28 +531,21 @@ class AuditLogger:
             },
             "summary": {
                 "total_events": len(events),
-                "by_severity": dict(self.severity_counts),
-                "by_category": {},
-                "unique_users": len(set(e.user_id for e in events if e.user_id)),
-                "unique_ips": len(set(e.client_ip for e in events if e.client_ip))
+                "by_severity": dict(severity_counts),
+                "by_category": dict(category_counts),
+                "unique_users": len(users),
+                "unique_ips": len(ips)
             },
             "security_metrics": {
-                "authentication_failures": len([e for e in events if "login_failed" in e.event_type]),
-                "privilege_escalations": len([e for e in events if "privilege" in e.event_type]),
-                "data_access_events": len([e for e in events if e.sensitive_data_accessed]),
-                "admin_actions": len([e for e in events if e.category == EventCategory.SYSTEM_ADMIN])
+                "authentication_failures": auth_failures,
+                "privilege_escalations": privilege_escalations,
+                "data_access_events": data_access_events,
+                "admin_actions": admin_actions
             },
             "compliance_issues": [],
             "recommendations": []
         }
         
-        # Category breakdown
-        for event in events:
-            category = event.category.value
-            if category not in report_data["summary"]["by_category"]:
-                report_data["summary"]["by_category"][category] = 0
-            report_data["summary"]["by_category"][category] += 1
-        
         # Identify compliance issues
         if report_data["security_metrics"]["authentication_failures"] > 100:
             report_data["compliance_issues"].append("High number of authentication failures detected")
@@ -461,18 +564,18 @@ class AuditLogger:
     
     def _generate_csv_report(self, events: List[AuditEvent]) -> str:
         """Generate CSV format report"""
-        output = []
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL)
         
         # CSV header
-        headers = [
+        writer.writerow([
             "timestamp", "event_type", "category", "severity", "user_id", 
             "client_ip", "endpoint", "success", "message"
-        ]
-        output.append(",".join(headers))
+        ])
         
-        # CSV rows
-        for event in events:
-            row = [
+        # CSV rows (csv.writer handles quoting of commas, quotes and newlines)
+        writer.writerows(
+            (
                 event.timestamp.isoformat(),
                 event.event_type,
                 event.category.value,
@@ -480,36 +583,53 @@ class AuditLogger:
                 event.user_id or "",
                 event.client_ip,
                 event.endpoint or "",
-                str(event.success),
-                event.message.replace('"', '""')  # Escape quotes
-            ]
-            output.append(",".join(f'"{field}"' for field in row))
+                event.success,
+                event.message
+            )
+            for event in events
+        )
         
-        return "\n".join(output)
+        return output.getvalue()
     
-    async def cleanup_old_logs(self) -> None:
+    async def cleanup_old_logs(self) -> List[str]:
         """Clean up old log files based on retention policy"""
-        cutoff_date = datetime.now() - timedelta(days=self.retention_days)
-        
-        deleted_files = []
-        for log_file in self.log_directory.glob("audit-*.jsonl*"):
-            try:
-                # Extract date from filename
-                file_date_str = self._extract_date_from_filename(str(log_file))
-                file_date = datetime.strptime(file_date_str, '%Y-%m-%d')
-                
-                if file_date < cutoff_date:
-                    log_file.unlink()
-                    deleted_files.append(str(log_file))
-                    
-            except Exception as e:
-                logger.warning("Failed to process log file for cleanup", file=str(log_file), error=str(e))
+        loop = asyncio.get_running_loop()
+        deleted_files = await loop.run_in_executor(None, self._cleanup_old_logs_sync)
         
         if deleted_files:
             logger.info("Old log files cleaned up", files=deleted_files, count=len(deleted_files))
         
         return deleted_files
     
+    def _cleanup_old_logs_sync(self) -> List[str]:
+        """Find and delete expired log files; runs in an executor thread"""
+        cutoff_date = datetime.now() - timedelta(days=self.retention_days)
+        
+        expired = []
+        with os.scandir(self.log_directory) as entries:
+            for entry in entries:
+                file_date = self._parse_log_file_date(entry.name)
+                if file_date and file_date < cutoff_date and ".jsonl" in entry.name:
+                    expired.append(entry.path)
+        
+        if not expired:
+            return []
+        
+        # Issue the unlink syscalls concurrently
+        with ThreadPoolExecutor(max_workers=min(8, len(expired))) as pool:
+            results = pool.map(self._unlink_log_file, expired)
+            return [path for path, deleted in zip(expired, results) if deleted]
+    
+    @staticmethod
+    def _unlink_log_file(path: str) -> bool:
+        """Delete a single log file, returning whether it was removed"""
+        try:
+            os.unlink(path)
+            return True
+        except OSError as e:
+            logger.warning("Failed to process log file for cleanup", file=path, error=str(e))
+            return False
+    
     def get_statistics(self) -> Dict[str, Any]:
         """Get audit logging statistics"""
         return {
@@ -519,6 +639,8 @@ class AuditLogger:
             "active_users": len(self.user_activity),
             "log_directory": str(self.log_directory),
             "current_log_file": self.current_log_file,
+            "pending_events": len(self.pending_events),
+            "dropped_events": self.dropped_events,
             "retention_days": self.retention_days
         }
 
@@ -529,6 +651,22 @@ class AuditMiddleware(BaseHTTPMiddleware):
     def __init__(self, app, audit_logger: AuditLogger):
         super().__init__(app)
         self.audit_logger = audit_logger
+        
+        # Retained events share one str object per distinct client value.
+        # These values are client-controlled, so unlike sys.intern the
+        # table is bounded and simply starts over when it fills up
+        self._shared_strings: Dict[str, str] = {}
+        self.max_shared_strings = 10000
+    
+    def _share(self, value: str) -> str:
+        """Return the stored copy of an equal string, remembering new ones"""
+        shared = self._shared_strings.get(value)
+        if shared is not None:
+            return shared
+        if len(self._shared_strings) >= self.max_shared_strings:
+            self._shared_strings.clear()
+        self._shared_strings[value] = value
+        return value
     
     async def dispatch(self, request: Request, call_next):
         start_time = datetime.now()
@@ -537,10 +675,12 @@ class AuditMiddleware(BaseHTTPMiddleware):
         event_id = f"req-{start_time.strftime('%Y%m%d%H%M%S')}-{id(request)}"
         
         # Extract request information
-        client_ip = request.client.host
-        user_agent = request.headers.get("user-agent", "")
-        method = request.method
-        endpoint = str(request.url.path)
+        # Cached on request.state so handlers reuse the same parsed details
+        client = request_client_info(request)
+        client_ip = self._share(client.ip)
+        user_agent = self._share(client.user_agent)
+        method = self._share(request.method)
+        endpoint = self._share(str(request.url.path))
         query_params = dict(request.query_params) if request.query_params else None
         
         # Process request
@@ -584,11 +724,14 @@ class AuditMiddleware(BaseHTTPMiddleware):
                 "content_type": response.headers.get("content-type", ""),
             },
             duration_ms=duration_ms,
-            response_size=len(response.body) if hasattr(response, 'body') else None
+            response_size=int(response.headers.get("content-length", 0)) or None
         )
         
-        # Log the event
-        await self.audit_logger.log_event(audit_event)
+        # Hand off to the flush task when it is running, otherwise log inline
+        if self.audit_logger.is_running:
+            self.audit_logger.enqueue_event(audit_event)
+        else:
+            await self.audit_logger.log_event(audit_event)
         
         return response
 
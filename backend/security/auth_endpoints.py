@@ -2,12 +2,15 @@
 Authentication Endpoints for BioThings Platform
 Implements login, logout, token refresh, and user management endpoints
 """
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, Any, Optional, List
-from fastapi import APIRouter, HTTPException, Depends, status, Request
-from fastapi.security import OAuth2PasswordRequestForm
-from pydantic import BaseModel, EmailStr, validator
+from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials
+from pydantic import BaseModel, ConfigDict, validator
+import re
 import secrets
+import orjson
 import structlog
 
 from .production_security import (
@@ -15,6 +18,8 @@ from .production_security import (
     SecurityManager, 
     User, 
     UserRole,
+    ClientInfo,
+    get_client_info,
     get_current_user,
     require_admin
 )
@@ -24,39 +29,60 @@ logger = structlog.get_logger()
 # Create router
 auth_router = APIRouter(prefix="/auth", tags=["authentication"])
 
+_USERNAME_RE = re.compile(r'[A-Za-z0-9_-]+')
+_EMAIL_RE = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+
 # Pydantic models for request/response
 class UserCreate(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     username: str
-    email: EmailStr
+    email: str
     password: str
     role: UserRole = UserRole.OBSERVER
     
     @validator('username')
     def username_alphanumeric(cls, v):
-        if not v.replace('_', '').replace('-', '').isalnum():
+        if not _USERNAME_RE.fullmatch(v):
             raise ValueError('Username must be alphanumeric (underscores and hyphens allowed)')
         if len(v) < 3:
             raise ValueError('Username must be at least 3 characters')
         return v
+    
+    @validator('email')
+    def email_format(cls, v):
+        if not _EMAIL_RE.fullmatch(v):
+            raise ValueError('Invalid email address')
+        return v
 
 class UserLogin(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     username: str
     password: str
 
 class TokenResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     access_token: str
     refresh_token: str
     token_type: str = "bearer"
     expires_in: int
 
 class TokenRefresh(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     refresh_token: str
 
 class PasswordChange(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     current_password: str
     new_password: str
 
 class UserResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     id: str
     username: str
     email: str
@@ -66,21 +92,38 @@ class UserResponse(BaseModel):
     last_login: Optional[datetime]
 
 class APIKeyCreate(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     name: str
     permissions: List[str]
 
 class APIKeyResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     api_key: str
     name: str
     permissions: List[str]
     created_at: datetime
 
 
+def _user_response(user: User) -> Dict[str, Any]:
+    """UserResponse fields of a user; the route's response_model validates them"""
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "role": user.role,
+        "is_active": user.is_active,
+        "created_at": user.created_at,
+        "last_login": user.last_login
+    }
+
+
 @auth_router.post("/register", response_model=UserResponse)
 async def register_user(
     user_data: UserCreate,
-    request: Request,
-    current_user: User = Depends(require_admin)
+    current_user: User = Depends(require_admin),
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Register a new user (Admin only)"""
     try:
@@ -92,22 +135,20 @@ async def register_user(
                 detail={"message": "Password does not meet requirements", "errors": password_errors}
             )
         
-        # Check if user already exists
-        existing_user = None
-        for user in security_manager.users.values():
-            if user.username == user_data.username or user.email == user_data.email:
-                existing_user = user
-                break
+        # Hash before the duplicate check so nothing awaits between the
+        # check and add_user; a concurrent registration cannot slip in
+        hashed_password = await security_manager.ahash_password(user_data.password)
         
-        if existing_user:
+        # Check if user already exists
+        if (user_data.username in security_manager.users_by_username
+                or user_data.email in security_manager.users_by_email):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="User with this username or email already exists"
             )
         
         # Create new user
-        user_id = f"user-{secrets.token_urlsafe(8)}"
-        hashed_password = security_manager.hash_password(user_data.password)
+        user_id = "user-" + secrets.token_hex(6)
         
         new_user = User(
             id=user_id,
@@ -119,31 +160,22 @@ async def register_user(
         )
         
         # Store user and password hash separately (in production, use proper database)
-        security_manager.users[user_id] = new_user
-        security_manager._password_hashes = getattr(security_manager, '_password_hashes', {})
+        security_manager.add_user(new_user)
         security_manager._password_hashes[user_id] = hashed_password
         
         # Log security event
-        security_manager.log_security_event(
+        security_manager.emit_event(
             "user_registered",
             current_user.id,
-            request.client.host,
-            request.headers.get("user-agent", ""),
+            client.ip,
+            client.user_agent,
             {"new_user_id": user_id, "new_user_role": user_data.role.value},
             "info"
         )
         
         logger.info("New user registered", user_id=user_id, username=user_data.username, role=user_data.role)
         
-        return UserResponse(
-            id=new_user.id,
-            username=new_user.username,
-            email=new_user.email,
-            role=new_user.role,
-            is_active=new_user.is_active,
-            created_at=new_user.created_at,
-            last_login=new_user.last_login
-        )
+        return _user_response(new_user)
         
     except HTTPException:
         raise
@@ -157,29 +189,33 @@ async def register_user(
 
 @auth_router.post("/login", response_model=TokenResponse)
 async def login(
-    request: Request,
-    form_data: OAuth2PasswordRequestForm = Depends()
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Authenticate user and return JWT tokens"""
-    client_ip = request.client.host
-    user_agent = request.headers.get("user-agent", "")
+    client_ip, user_agent = client
+    now = datetime.utcnow()
     
     try:
         # Find user by username
-        user = None
-        for u in security_manager.users.values():
-            if u.username == form_data.username:
-                user = u
-                break
+        user = security_manager.users_by_username.get(form_data.username)
+        
+        # Always run a bcrypt verify, against a dummy hash for unknown users,
+        # so response time does not reveal whether the username exists
+        stored_hash = security_manager._password_hashes.get(user.id) if user else None
+        password_valid = await security_manager.averify_password(
+            form_data.password, stored_hash or security_manager.dummy_password_hash
+        ) and stored_hash is not None
         
         if not user:
-            security_manager.log_security_event(
+            security_manager.emit_event(
                 "login_failed_user_not_found",
                 None,
                 client_ip,
                 user_agent,
                 {"username": form_data.username},
-                "warning"
+                "warning",
+                timestamp=now
             )
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -188,63 +224,63 @@ async def login(
         
         # Check if user is active
         if not user.is_active:
-            security_manager.log_security_event(
+            security_manager.emit_event(
                 "login_failed_user_inactive",
                 user.id,
                 client_ip,
                 user_agent,
                 {},
-                "warning"
+                "warning",
+                timestamp=now
             )
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Account is inactive"
+                detail="Invalid credentials"
             )
         
         # Check if account is locked
-        if user.account_locked_until and user.account_locked_until > datetime.utcnow():
-            security_manager.log_security_event(
+        if user.account_locked_until and user.account_locked_until > now:
+            locked_until = user.account_locked_until.isoformat()
+            security_manager.emit_event(
                 "login_failed_account_locked",
                 user.id,
                 client_ip,
                 user_agent,
-                {"locked_until": user.account_locked_until.isoformat()},
-                "warning"
+                {"locked_until": locked_until},
+                "warning",
+                timestamp=now
             )
             raise HTTPException(
                 status_code=status.HTTP_423_LOCKED,
-                detail=f"Account locked until {user.account_locked_until.isoformat()}"
+                detail=f"Account locked until {locked_until}"
             )
         
-        # Verify password
-        password_hashes = getattr(security_manager, '_password_hashes', {})
-        stored_hash = password_hashes.get(user.id)
-        
-        if not stored_hash or not security_manager.verify_password(form_data.password, stored_hash):
+        # Check password
+        if not password_valid:
             # Increment failed login attempts
             user.failed_login_attempts += 1
             
             # Lock account if too many failed attempts
             if user.failed_login_attempts >= security_manager.config.MAX_LOGIN_ATTEMPTS:
-                user.account_locked_until = datetime.utcnow() + timedelta(
-                    minutes=security_manager.config.LOCKOUT_DURATION_MINUTES
-                )
-                security_manager.log_security_event(
+                user.account_locked_until = now + security_manager.config.lockout_duration
+                security_manager.emit_event(
                     "account_locked_too_many_attempts",
                     user.id,
                     client_ip,
                     user_agent,
                     {"failed_attempts": user.failed_login_attempts},
-                    "critical"
+                    "critical",
+                    timestamp=now
                 )
             
-            security_manager.log_security_event(
+            security_manager.emit_event(
                 "login_failed_invalid_password",
                 user.id,
                 client_ip,
                 user_agent,
                 {"failed_attempts": user.failed_login_attempts},
-                "warning"
+                "warning",
+                timestamp=now
             )
             
             raise HTTPException(
@@ -255,20 +291,21 @@ async def login(
         # Reset failed login attempts on successful login
         user.failed_login_attempts = 0
         user.account_locked_until = None
-        user.last_login = datetime.utcnow()
+        user.last_login = now
         
         # Create tokens
         access_token = security_manager.create_access_token(user.id)
         refresh_token = security_manager.create_refresh_token(user.id)
         
         # Log successful login
-        security_manager.log_security_event(
+        security_manager.emit_event(
             "login_successful",
             user.id,
             client_ip,
             user_agent,
             {"role": user.role.value},
-            "info"
+            "info",
+            timestamp=now
         )
         
         logger.info("User logged in successfully", user_id=user.id, username=user.username)
@@ -276,7 +313,7 @@ async def login(
         return TokenResponse(
             access_token=access_token,
             refresh_token=refresh_token,
-            expires_in=security_manager.config.JWT_EXPIRATION_HOURS * 3600
+            expires_in=security_manager.config.jwt_expires_in_seconds
         )
         
     except HTTPException:
@@ -291,12 +328,11 @@ async def login(
 
 @auth_router.post("/refresh", response_model=TokenResponse)
 async def refresh_token(
-    request: Request,
-    token_data: TokenRefresh
+    token_data: TokenRefresh,
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Refresh access token using refresh token"""
-    client_ip = request.client.host
-    user_agent = request.headers.get("user-agent", "")
+    client_ip, user_agent = client
     
     try:
         # Verify refresh token
@@ -312,7 +348,7 @@ async def refresh_token(
         user = security_manager.users.get(user_id)
         
         if not user or not user.is_active:
-            security_manager.log_security_event(
+            security_manager.emit_event(
                 "token_refresh_failed_user_inactive",
                 user_id,
                 client_ip,
@@ -325,24 +361,34 @@ async def refresh_token(
                 detail="User not found or inactive"
             )
         
-        # Create new tokens
-        new_access_token = security_manager.create_access_token(user_id)
-        new_refresh_token = security_manager.create_refresh_token(user_id)
+        # Concurrent retries with the same refresh token get the same new pair
+        recent = security_manager.get_recent_refresh(token_data.refresh_token)
+        if recent:
+            new_access_token, new_refresh_token = recent
+            details = {"coalesced": True}
+        else:
+            # Create new tokens
+            new_access_token = security_manager.create_access_token(user_id)
+            new_refresh_token = security_manager.create_refresh_token(user_id)
+            security_manager.remember_refresh(
+                token_data.refresh_token, (new_access_token, new_refresh_token)
+            )
+            details = {}
         
-        # Log token refresh
-        security_manager.log_security_event(
+        # Log token refresh, including retries served from the replay window
+        security_manager.emit_event(
             "token_refreshed",
             user_id,
             client_ip,
             user_agent,
-            {},
+            details,
             "info"
         )
         
         return TokenResponse(
             access_token=new_access_token,
             refresh_token=new_refresh_token,
-            expires_in=security_manager.config.JWT_EXPIRATION_HOURS * 3600
+            expires_in=security_manager.config.jwt_expires_in_seconds
         )
         
     except HTTPException:
@@ -357,15 +403,18 @@ async def refresh_token(
 
 @auth_router.post("/logout")
 async def logout(
-    request: Request,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security_manager.bearer_scheme),
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Logout user (token invalidation would be implemented with token blacklist)"""
-    client_ip = request.client.host
-    user_agent = request.headers.get("user-agent", "")
+    client_ip, user_agent = client
+    
+    # Stop serving this token from the verification cache
+    security_manager.forget_token(credentials.credentials)
     
     # Log logout event
-    security_manager.log_security_event(
+    security_manager.emit_event(
         "user_logout",
         current_user.id,
         client_ip,
@@ -382,34 +431,26 @@ async def logout(
 @auth_router.get("/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     """Get current user information"""
-    return UserResponse(
-        id=current_user.id,
-        username=current_user.username,
-        email=current_user.email,
-        role=current_user.role,
-        is_active=current_user.is_active,
-        created_at=current_user.created_at,
-        last_login=current_user.last_login
-    )
+    return _user_response(current_user)
 
 
 @auth_router.post("/change-password")
 async def change_password(
-    request: Request,
     password_data: PasswordChange,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Change user password"""
-    client_ip = request.client.host
-    user_agent = request.headers.get("user-agent", "")
+    client_ip, user_agent = client
     
     try:
         # Verify current password
-        password_hashes = getattr(security_manager, '_password_hashes', {})
-        stored_hash = password_hashes.get(current_user.id)
+        stored_hash = security_manager._password_hashes.get(current_user.id)
         
-        if not stored_hash or not security_manager.verify_password(password_data.current_password, stored_hash):
-            security_manager.log_security_event(
+        if not stored_hash or not await security_manager.averify_password(
+            password_data.current_password, stored_hash
+        ):
+            security_manager.emit_event(
                 "password_change_failed_invalid_current",
                 current_user.id,
                 client_ip,
@@ -431,11 +472,11 @@ async def change_password(
             )
         
         # Update password
-        new_hash = security_manager.hash_password(password_data.new_password)
-        password_hashes[current_user.id] = new_hash
+        new_hash = await security_manager.ahash_password(password_data.new_password)
+        security_manager._password_hashes[current_user.id] = new_hash
         
         # Log password change
-        security_manager.log_security_event(
+        security_manager.emit_event(
             "password_changed",
             current_user.id,
             client_ip,
@@ -463,30 +504,38 @@ async def list_users(
     current_user: User = Depends(require_admin)
 ):
     """List all users (Admin only)"""
-    users = []
-    for user in security_manager.users.values():
-        users.append(UserResponse(
-            id=user.id,
-            username=user.username,
-            email=user.email,
-            role=user.role,
-            is_active=user.is_active,
-            created_at=user.created_at,
-            last_login=user.last_login
-        ))
+    return [_user_response(user) for user in security_manager.users.values()]
+
+
+@auth_router.get("/users/export")
+async def export_users(
+    current_user: User = Depends(require_admin)
+):
+    """Stream all users as newline-delimited JSON (Admin only)"""
+    async def stream_users():
+        # Snapshot references so concurrent registrations don't break iteration
+        for user in tuple(security_manager.users.values()):
+            yield orjson.dumps({
+                "id": user.id,
+                "username": user.username,
+                "email": user.email,
+                "role": user.role,
+                "is_active": user.is_active,
+                "created_at": user.created_at,
+                "last_login": user.last_login
+            }) + b"\n"
     
-    return users
+    return StreamingResponse(stream_users(), media_type="application/x-ndjson")
 
 
 @auth_router.post("/users/{user_id}/deactivate")
 async def deactivate_user(
     user_id: str,
-    request: Request,
-    current_user: User = Depends(require_admin)
+    current_user: User = Depends(require_admin),
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Deactivate a user (Admin only)"""
-    client_ip = request.client.host
-    user_agent = request.headers.get("user-agent", "")
+    client_ip, user_agent = client
     
     user = security_manager.users.get(user_id)
     if not user:
@@ -504,7 +553,7 @@ async def deactivate_user(
     user.is_active = False
     
     # Log user deactivation
-    security_manager.log_security_event(
+    security_manager.emit_event(
         "user_deactivated",
         current_user.id,
         client_ip,
@@ -520,13 +569,12 @@ async def deactivate_user(
 
 @auth_router.post("/api-keys", response_model=APIKeyResponse)
 async def create_api_key(
-    request: Request,
     api_key_data: APIKeyCreate,
-    current_user: User = Depends(require_admin)
+    current_user: User = Depends(require_admin),
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Create new API key (Admin only)"""
-    client_ip = request.client.host
-    user_agent = request.headers.get("user-agent", "")
+    client_ip, user_agent = client
     
     try:
         api_key = security_manager.generate_api_key(
@@ -534,10 +582,10 @@ async def create_api_key(
             permissions=api_key_data.permissions
         )
         
-        key_info = security_manager.api_keys[api_key]
+        key_info = security_manager.get_api_key_info(api_key)
         
         # Log API key creation
-        security_manager.log_security_event(
+        security_manager.emit_event(
             "api_key_created",
             current_user.id,
             client_ip,
@@ -568,40 +616,58 @@ async def list_api_keys(
     current_user: User = Depends(require_admin)
 ):
     """List all API keys (Admin only)"""
-    keys = []
-    for api_key, key_info in security_manager.api_keys.items():
-        keys.append({
-            "api_key": api_key[:8] + "..." + api_key[-4:],  # Masked key
+    keys = [
+        {
+            "api_key": key_info["masked"],
             "name": key_info["name"],
             "permissions": key_info["permissions"],
             "created_at": key_info["created_at"],
             "last_used": key_info["last_used"],
             "usage_count": key_info["usage_count"]
-        })
+        }
+        for key_info in security_manager.api_keys.values()
+    ]
     
     return {"api_keys": keys}
 
 
+@auth_router.get("/api-keys/export")
+async def export_api_keys(
+    current_user: User = Depends(require_admin)
+):
+    """Stream all API keys as newline-delimited JSON (Admin only)"""
+    async def stream_api_keys():
+        for key_info in tuple(security_manager.api_keys.values()):
+            yield orjson.dumps({
+                "api_key": key_info["masked"],
+                "name": key_info["name"],
+                "permissions": key_info["permissions"],
+                "created_at": key_info["created_at"],
+                "last_used": key_info["last_used"],
+                "usage_count": key_info["usage_count"]
+            }) + b"\n"
+    
+    return StreamingResponse(stream_api_keys(), media_type="application/x-ndjson")
+
+
 @auth_router.delete("/api-keys/{api_key}")
 async def revoke_api_key(
     api_key: str,
-    request: Request,
-    current_user: User = Depends(require_admin)
+    current_user: User = Depends(require_admin),
+    client: ClientInfo = Depends(get_client_info)
 ):
     """Revoke an API key (Admin only)"""
-    client_ip = request.client.host
-    user_agent = request.headers.get("user-agent", "")
+    client_ip, user_agent = client
     
-    if api_key not in security_manager.api_keys:
+    key_info = security_manager.revoke_api_key(api_key)
+    if key_info is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="API key not found"
         )
     
-    key_info = security_manager.api_keys.pop(api_key)
-    
     # Log API key revocation
-    security_manager.log_security_event(
+    security_manager.emit_event(
         "api_key_revoked",
         current_user.id,
         client_ip,
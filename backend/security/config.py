@@ -3,16 +3,120 @@ Security Configuration Management for BioThings Platform
 Handles environment-based configuration, secrets management, and security settings
 """
 import os
+import re
+import hashlib
+import operator
+from functools import lru_cache, reduce
 import secrets
-from typing import Dict, Any, List, Optional
+from typing import ClassVar, Dict, Any, Final, Iterator, List, Mapping, Optional, Tuple
+from types import MappingProxyType
 from dataclasses import dataclass, field
 from enum import Enum
-import json
+from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlsplit
+import orjson
 import structlog
 
 logger = structlog.get_logger()
 
+# Passwords rejected when prevent_common_passwords is enabled
+_COMMON_PASSWORDS = frozenset({
+    "password", "123456", "password123", "admin", "qwerty",
+    "letmein", "welcome", "monkey", "dragon", "master"
+})
+_SPECIAL_CHARS = frozenset("!@#$%^&*()_+-=[]{}|;:,.<>?")
+_ALLOWED_JWT_ALGS = frozenset({"HS256", "HS384", "HS512", "RS256", "RS384", "RS512"})
+_LOOPBACK_HOSTS = frozenset({"localhost", "127.0.0.1", "::1"})
+_AUDIT_SEVERITIES = frozenset({"debug", "info", "warning", "error", "critical"})
+
+# Character class bits for single-pass password classification
+_UPPER, _LOWER, _DIGIT, _SPECIAL = 1, 2, 4, 8
+
+
+def _class_bit(code: int) -> int:
+    c = chr(code)
+    if code > 127:
+        return 0
+    if c.isupper():
+        return _UPPER
+    if c.islower():
+        return _LOWER
+    if c.isdigit():
+        return _DIGIT
+    if c in _SPECIAL_CHARS:
+        return _SPECIAL
+    return 0
+
+
+_CLASS_TABLE = bytes(_class_bit(code) for code in range(256))
+_ASCII_CHARS = frozenset(map(chr, range(128)))
+
+# Shared, read-only default rate limits per endpoint
+_DEFAULT_ENDPOINT_LIMITS: Mapping[str, Mapping[str, int]] = MappingProxyType({
+    "/auth/login": MappingProxyType({"requests_per_minute": 10, "burst_requests": 3}),
+    "/auth/register": MappingProxyType({"requests_per_minute": 5, "burst_requests": 2}),
+    "/api/experiments/start": MappingProxyType({"requests_per_minute": 20, "burst_requests": 5}),
+    "/api/chat": MappingProxyType({"requests_per_minute": 50, "burst_requests": 10})
+})
+
+# Parsed secrets files keyed by path, invalidated by modification time
+_SECRETS_CACHE: Dict[Path, Tuple[int, Dict[str, Any]]] = {}
+
+
+def _key_fingerprint(key: str) -> str:
+    """Stable, non-reversible fingerprint for comparing secrets across processes"""
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+def _read_secrets_file(path: Path) -> Optional[Dict[str, Any]]:
+    """Read a secrets file, reusing the parsed copy while its mtime is unchanged"""
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        _SECRETS_CACHE.pop(path, None)
+        return None
+    
+    cached = _SECRETS_CACHE.get(path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    
+    secrets_data = orjson.loads(path.read_bytes())
+    _SECRETS_CACHE[path] = (mtime_ns, secrets_data)
+    return secrets_data
+
+
+def _classify_password(password: str) -> int:
+    """OR together the class bits of every character in the password"""
+    encoded = password.encode("ascii", "ignore")
+    seen = reduce(operator.or_, set(encoded.translate(_CLASS_TABLE)), 0)
+    
+    # Non-ASCII characters keep the unicode-aware checks
+    if len(encoded) != len(password):
+        for c in set(password).difference(_ASCII_CHARS):
+            if c.isupper():
+                seen |= _UPPER
+            elif c.islower():
+                seen |= _LOWER
+            elif c.isdigit():
+                seen |= _DIGIT
+    return seen
+
+
+# Connection URLs are cached by their parts rather than on the config objects,
+# so a changed field is picked up and the URL never appears among the fields
+@lru_cache(maxsize=16)
+def _database_url(username: str, password: str, host: str, port: int,
+                  database: str, ssl_mode: str) -> str:
+    return f"postgresql://{username}:{password}@{host}:{port}/{database}?sslmode={ssl_mode}"
+
+
+@lru_cache(maxsize=16)
+def _redis_url(password: str, host: str, port: int, database: int, ssl: bool) -> str:
+    protocol = "rediss" if ssl else "redis"
+    auth = f":{password}@" if password else ""
+    return f"{protocol}://{auth}{host}:{port}/{database}"
+
 
 class Environment(str, Enum):
     """Deployment environments"""
@@ -30,7 +134,7 @@ class SecurityLevel(str, Enum):
     CRITICAL = "critical"
 
 
-@dataclass
+@dataclass(slots=True)
 class DatabaseConfig:
     """Database configuration"""
     host: str = "localhost"
@@ -45,10 +149,12 @@ class DatabaseConfig:
     @property
     def url(self) -> str:
         """Get database URL"""
-        return f"postgresql://{self.username}:{self.password}@{self.host}:{self.port}/{self.database}?sslmode={self.ssl_mode}"
+        return _database_url(
+            self.username, self.password, self.host, self.port, self.database, self.ssl_mode
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class RedisConfig:
     """Redis configuration"""
     host: str = "localhost"
@@ -60,34 +166,37 @@ class RedisConfig:
     @property
     def url(self) -> str:
         """Get Redis URL"""
-        protocol = "rediss" if self.ssl else "redis"
-        auth = f":{self.password}@" if self.password else ""
-        return f"{protocol}://{auth}{self.host}:{self.port}/{self.database}"
+        return _redis_url(self.password, self.host, self.port, self.database, self.ssl)
 
 
-@dataclass
+@dataclass(slots=True)
 class JWTConfig:
     """JWT configuration"""
-    secret_key: str = field(default_factory=lambda: secrets.token_urlsafe(32))
+    secret_key: str = ""  # Generated by ensure_key() if not configured
     algorithm: str = "HS256"
     access_token_expire_hours: int = 24
     refresh_token_expire_days: int = 30
     issuer: str = "biothings-platform"
     audience: str = "biothings-api"
     
-    def validate(self) -> List[str]:
-        """Validate JWT configuration"""
-        errors = []
+    def ensure_key(self) -> bool:
+        """Generate a random secret key if none was configured"""
+        if self.secret_key:
+            return False
+        self.secret_key = secrets.token_urlsafe(32)
+        return True
+    
+    def validate(self) -> Iterator[str]:
+        """Validate JWT configuration, yielding each error"""
         if len(self.secret_key) < 32:
-            errors.append("JWT secret key must be at least 32 characters")
-        if self.algorithm not in ["HS256", "HS384", "HS512", "RS256", "RS384", "RS512"]:
-            errors.append("Invalid JWT algorithm")
+            yield "JWT secret key must be at least 32 characters"
+        if self.algorithm not in _ALLOWED_JWT_ALGS:
+            yield "Invalid JWT algorithm"
         if self.access_token_expire_hours < 1 or self.access_token_expire_hours > 168:  # 1 hour to 1 week
-            errors.append("Access token expiration must be between 1 and 168 hours")
-        return errors
+            yield "Access token expiration must be between 1 and 168 hours"
 
 
-@dataclass
+@dataclass(slots=True)
 class RateLimitConfig:
     """Rate limiting configuration"""
     enabled: bool = True
@@ -96,16 +205,13 @@ class RateLimitConfig:
     ban_duration_minutes: int = 15
     bypass_api_keys: List[str] = field(default_factory=list)
     
-    # Endpoint-specific limits
-    endpoint_limits: Dict[str, Dict[str, int]] = field(default_factory=lambda: {
-        "/auth/login": {"requests_per_minute": 10, "burst_requests": 3},
-        "/auth/register": {"requests_per_minute": 5, "burst_requests": 2},
-        "/api/experiments/start": {"requests_per_minute": 20, "burst_requests": 5},
-        "/api/chat": {"requests_per_minute": 50, "burst_requests": 10}
-    })
+    # Endpoint-specific limits (replace with a new dict to override)
+    endpoint_limits: Mapping[str, Mapping[str, int]] = field(
+        default_factory=lambda: _DEFAULT_ENDPOINT_LIMITS
+    )
 
 
-@dataclass
+@dataclass(slots=True)
 class CORSConfig:
     """CORS configuration"""
     enabled: bool = True
@@ -114,9 +220,19 @@ class CORSConfig:
     allow_headers: List[str] = field(default_factory=lambda: ["*"])
     allow_credentials: bool = True
     max_age: int = 86400  # 24 hours
+    
+    @property
+    def origin_hosts(self) -> frozenset:
+        """Get hostnames of the allowed origins"""
+        # Schemeless entries such as "localhost:3000" only parse as a host
+        # when marked as a network location
+        return frozenset(
+            urlsplit(origin if "://" in origin else f"//{origin}").hostname
+            for origin in self.allow_origins
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class PasswordPolicyConfig:
     """Password policy configuration"""
     min_length: int = 8
@@ -127,69 +243,121 @@ class PasswordPolicyConfig:
     require_special_chars: bool = True
     prevent_common_passwords: bool = True
     password_history_count: int = 5
+    _compiled: Optional[re.Pattern] = field(default=None, init=False, repr=False, compare=False)
+    _compiled_key: tuple = field(default=(), init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self._compile_policy()
+    
+    def _policy_key(self) -> tuple:
+        return (
+            self.min_length, self.max_length, self.require_uppercase,
+            self.require_lowercase, self.require_numbers, self.require_special_chars
+        )
+    
+    def _compile_policy(self):
+        """Build a single anchored pattern that accepts fully compliant passwords"""
+        lookaheads = []
+        if self.require_uppercase:
+            lookaheads.append(r"(?=.*[A-Z])")
+        if self.require_lowercase:
+            lookaheads.append(r"(?=.*[a-z])")
+        if self.require_numbers:
+            lookaheads.append(r"(?=.*[0-9])")
+        if self.require_special_chars:
+            special = re.escape("".join(sorted(_SPECIAL_CHARS)))
+            lookaheads.append(f"(?=.*[{special}])")
+        
+        pattern = "".join(lookaheads) + f"[\\s\\S]{{{self.min_length},{self.max_length}}}\\Z"
+        self._compiled = re.compile(pattern, re.DOTALL)
+        self._compiled_key = self._policy_key()
     
     def validate_password(self, password: str) -> List[str]:
         """Validate password against policy"""
+        # Policy fields may be adjusted after construction (e.g. per environment)
+        if self._compiled_key != self._policy_key():
+            self._compile_policy()
+        
+        # Fast path: one regex scan for compliant passwords
+        if self._compiled.match(password):
+            if self.prevent_common_passwords and password.lower() in _COMMON_PASSWORDS:
+                return ["Password is too common"]
+            return []
+        
         errors = []
+        seen = _classify_password(password)
         
         if len(password) < self.min_length:
             errors.append(f"Password must be at least {self.min_length} characters")
         if len(password) > self.max_length:
             errors.append(f"Password must be at most {self.max_length} characters")
         
-        if self.require_uppercase and not any(c.isupper() for c in password):
+        if self.require_uppercase and not seen & _UPPER:
             errors.append("Password must contain uppercase letters")
         
-        if self.require_lowercase and not any(c.islower() for c in password):
+        if self.require_lowercase and not seen & _LOWER:
             errors.append("Password must contain lowercase letters")
         
-        if self.require_numbers and not any(c.isdigit() for c in password):
+        if self.require_numbers and not seen & _DIGIT:
             errors.append("Password must contain numbers")
         
-        if self.require_special_chars and not any(c in "!@#$%^&*()_+-=[]{}|;:,.<>?" for c in password):
+        if self.require_special_chars and not seen & _SPECIAL:
             errors.append("Password must contain special characters")
         
         # Check common passwords if enabled
-        if self.prevent_common_passwords:
-            common_passwords = {
-                "password", "123456", "password123", "admin", "qwerty",
-                "letmein", "welcome", "monkey", "dragon", "master"
-            }
-            if password.lower() in common_passwords:
-                errors.append("Password is too common")
+        if self.prevent_common_passwords and password.lower() in _COMMON_PASSWORDS:
+            errors.append("Password is too common")
         
         return errors
 
 
-@dataclass
+# Default security header values
+STRICT_TRANSPORT_SECURITY: Final[str] = "max-age=31536000; includeSubDomains"
+CONTENT_SECURITY_POLICY: Final[str] = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
+    "style-src 'self' 'unsafe-inline'; "
+    "img-src 'self' data: https:; "
+    "font-src 'self' https:; "
+    "connect-src 'self' wss: https:;"
+)
+PERMISSIONS_POLICY: Final[str] = (
+    "geolocation=(), "
+    "microphone=(), "
+    "camera=(), "
+    "payment=(), "
+    "usb=(), "
+    "magnetometer=(), "
+    "gyroscope=(), "
+    "accelerometer=()"
+)
+
+
+@dataclass(slots=True)
 class SecurityHeadersConfig:
     """Security headers configuration"""
-    strict_transport_security: str = "max-age=31536000; includeSubDomains"
-    content_security_policy: str = (
-        "default-src 'self'; "
-        "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
-        "style-src 'self' 'unsafe-inline'; "
-        "img-src 'self' data: https:; "
-        "font-src 'self' https:; "
-        "connect-src 'self' wss: https:;"
-    )
+    strict_transport_security: str = STRICT_TRANSPORT_SECURITY
+    content_security_policy: str = CONTENT_SECURITY_POLICY
     x_content_type_options: str = "nosniff"
     x_frame_options: str = "DENY"
     x_xss_protection: str = "1; mode=block"
     referrer_policy: str = "strict-origin-when-cross-origin"
-    permissions_policy: str = (
-        "geolocation=(), "
-        "microphone=(), "
-        "camera=(), "
-        "payment=(), "
-        "usb=(), "
-        "magnetometer=(), "
-        "gyroscope=(), "
-        "accelerometer=()"
-    )
+    permissions_policy: str = PERMISSIONS_POLICY
+    
+    def as_headers(self) -> Dict[str, str]:
+        """Response headers keyed by their HTTP names"""
+        return {
+            "Strict-Transport-Security": self.strict_transport_security,
+            "Content-Security-Policy": self.content_security_policy,
+            "X-Content-Type-Options": self.x_content_type_options,
+            "X-Frame-Options": self.x_frame_options,
+            "X-XSS-Protection": self.x_xss_protection,
+            "Referrer-Policy": self.referrer_policy,
+            "Permissions-Policy": self.permissions_policy
+        }
 
 
-@dataclass
+@dataclass(slots=True)
 class AuditConfig:
     """Audit logging configuration"""
     enabled: bool = True
@@ -199,6 +367,13 @@ class AuditConfig:
     log_data_access: bool = True
     retention_days: int = 90
     export_format: str = "json"  # json, csv, syslog
+    min_severity: str = "info"  # debug, info, warning, error, critical
+    
+    # Security event buffering: events are recorded in batches of batch_size
+    # or every flush_interval_seconds, whichever comes first
+    buffer_size: int = 10000
+    batch_size: int = 200
+    flush_interval_seconds: float = 1.0
     
     # Events to always log
     critical_events: List[str] = field(default_factory=lambda: [
@@ -206,9 +381,18 @@ class AuditConfig:
         "data_export", "system_configuration_change", "api_key_created",
         "user_created", "user_deleted", "password_changed"
     ])
+    
+    def validate(self) -> Iterator[str]:
+        """Validate audit configuration, yielding each error"""
+        if self.min_severity.lower() not in _AUDIT_SEVERITIES:
+            yield f"Audit minimum severity must be one of: {', '.join(sorted(_AUDIT_SEVERITIES))}"
+        if self.buffer_size < 1 or self.batch_size < 1:
+            yield "Audit buffer and batch sizes must be positive"
+        if self.flush_interval_seconds <= 0:
+            yield "Audit flush interval must be positive"
 
 
-@dataclass
+@dataclass(slots=True)
 class EncryptionConfig:
     """Encryption configuration"""
     algorithm: str = "AES-256-GCM"
@@ -220,13 +404,70 @@ class EncryptionConfig:
         return secrets.token_urlsafe(32)
 
 
+def _split_origins(value: str) -> List[str]:
+    return value.split(",")
+
+
 class SecurityConfigManager:
     """Security configuration manager"""
     
+    # (attribute path, environment variable, caster); empty values are ignored
+    _ENV_SPEC = (
+        # Database
+        ("database.host", "DB_HOST", str),
+        ("database.port", "DB_PORT", int),
+        ("database.database", "DB_NAME", str),
+        ("database.username", "DB_USER", str),
+        ("database.password", "DB_PASSWORD", str),
+        # Redis
+        ("redis.host", "REDIS_HOST", str),
+        ("redis.port", "REDIS_PORT", int),
+        ("redis.password", "REDIS_PASSWORD", str),
+        # JWT
+        ("jwt.secret_key", "JWT_SECRET_KEY", str),
+        ("jwt.algorithm", "JWT_ALGORITHM", str),
+        # Security
+        ("security_level", "SECURITY_LEVEL", SecurityLevel),
+        # CORS
+        ("cors.allow_origins", "ALLOWED_ORIGINS", _split_origins),
+        # Audit
+        ("audit.buffer_size", "AUDIT_BUFFER_SIZE", int),
+        ("audit.batch_size", "AUDIT_BATCH_SIZE", int),
+        ("audit.flush_interval_seconds", "AUDIT_FLUSH_INTERVAL", float),
+        ("audit.min_severity", "AUDIT_MIN_SEVERITY", str.lower),
+    )
+    
+    # Per-environment overrides applied after environment variables and secrets
+    _PROFILES: ClassVar[Mapping[Environment, Mapping[str, Any]]] = MappingProxyType({
+        # Production security settings
+        Environment.PRODUCTION: MappingProxyType({
+            "jwt.access_token_expire_hours": 1,  # Shorter token lifetime
+            "rate_limit.requests_per_minute": 60,  # More restrictive
+            "cors.allow_origins": ("https://biothings.ai",),  # Specific domain
+            "password_policy.min_length": 12,  # Stronger passwords
+            "audit.log_all_requests": True,  # Full logging
+        }),
+        # Staging settings
+        Environment.STAGING: MappingProxyType({
+            "jwt.access_token_expire_hours": 2,
+            "rate_limit.requests_per_minute": 80,
+            "cors.allow_origins": ("https://staging.biothings.ai",),
+        }),
+        # Development settings (more permissive)
+        Environment.DEVELOPMENT: MappingProxyType({
+            "jwt.access_token_expire_hours": 24,
+            "rate_limit.requests_per_minute": 200,
+            "cors.allow_origins": ("http://localhost:3000", "http://127.0.0.1:3000"),
+            "password_policy.min_length": 8,
+            "audit.log_all_requests": False,
+        }),
+    })
+    
     def __init__(self, environment: Environment = Environment.DEVELOPMENT):
         self.environment = environment
         self.config_dir = Path("config")
         self.secrets_file = self.config_dir / f".secrets.{environment.value}.json"
+        self._generated_jwt_key: Optional[str] = None
         
         # Initialize configurations
         self.database = DatabaseConfig()
@@ -255,102 +496,98 @@ class SecurityConfigManager:
         
         # Adjust for environment
         self._adjust_for_environment()
+        
+        # Fall back to a random JWT key, remembering it was not configured
+        if self.jwt.ensure_key():
+            self._generated_jwt_key = self.jwt.secret_key
+    
+    def reload(self):
+        """Re-read environment and secrets file, bypassing the secrets cache"""
+        _SECRETS_CACHE.pop(self.secrets_file, None)
+        self.load_config()
+        self.validate_config()
     
     def _load_from_environment(self):
         """Load configuration from environment variables"""
-        # Database
-        self.database.host = os.getenv("DB_HOST", self.database.host)
-        self.database.port = int(os.getenv("DB_PORT", self.database.port))
-        self.database.database = os.getenv("DB_NAME", self.database.database)
-        self.database.username = os.getenv("DB_USER", self.database.username)
-        self.database.password = os.getenv("DB_PASSWORD", self.database.password)
-        
-        # Redis
-        self.redis.host = os.getenv("REDIS_HOST", self.redis.host)
-        self.redis.port = int(os.getenv("REDIS_PORT", self.redis.port))
-        self.redis.password = os.getenv("REDIS_PASSWORD", self.redis.password)
-        
-        # JWT
-        self.jwt.secret_key = os.getenv("JWT_SECRET_KEY", self.jwt.secret_key)
-        self.jwt.algorithm = os.getenv("JWT_ALGORITHM", self.jwt.algorithm)
-        
-        # Security
-        if os.getenv("SECURITY_LEVEL"):
-            self.security_level = SecurityLevel(os.getenv("SECURITY_LEVEL"))
-        
-        # CORS
-        if os.getenv("ALLOWED_ORIGINS"):
-            self.cors.allow_origins = os.getenv("ALLOWED_ORIGINS").split(",")
+        env = os.environ
+        for path, var, cast in self._ENV_SPEC:
+            value = env.get(var)
+            if value:
+                self._set_path(path, cast(value))
+    
+    def _set_path(self, path: str, value: Any):
+        """Set a (possibly nested) attribute given a dotted path"""
+        section, _, name = path.rpartition(".")
+        target = getattr(self, section) if section else self
+        setattr(target, name, value)
     
     def _load_from_files(self):
         """Load configuration from files"""
         # Load secrets file if it exists
-        if self.secrets_file.exists():
-            try:
-                with open(self.secrets_file, 'r') as f:
-                    secrets_data = json.load(f)
-                
-                # Apply secrets to configuration
-                if "jwt_secret_key" in secrets_data:
-                    self.jwt.secret_key = secrets_data["jwt_secret_key"]
-                if "db_password" in secrets_data:
-                    self.database.password = secrets_data["db_password"]
-                if "redis_password" in secrets_data:
-                    self.redis.password = secrets_data["redis_password"]
-                    
-            except Exception as e:
-                logger.warning("Failed to load secrets file", error=str(e))
+        try:
+            secrets_data = _read_secrets_file(self.secrets_file)
+        except Exception as e:
+            logger.warning("Failed to load secrets file", error=str(e))
+            return
+        
+        if secrets_data:
+            # Apply secrets to configuration
+            if "jwt_secret_key" in secrets_data:
+                self.jwt.secret_key = secrets_data["jwt_secret_key"]
+            if "db_password" in secrets_data:
+                self.database.password = secrets_data["db_password"]
+            if "redis_password" in secrets_data:
+                self.redis.password = secrets_data["redis_password"]
     
     def _adjust_for_environment(self):
         """Adjust configuration based on environment"""
-        if self.environment == Environment.PRODUCTION:
-            # Production security settings
-            self.jwt.access_token_expire_hours = 1  # Shorter token lifetime
-            self.rate_limit.requests_per_minute = 60  # More restrictive
-            self.cors.allow_origins = ["https://biothings.ai"]  # Specific domain
-            self.password_policy.min_length = 12  # Stronger passwords
-            self.audit.log_all_requests = True  # Full logging
-            
-        elif self.environment == Environment.STAGING:
-            # Staging settings
-            self.jwt.access_token_expire_hours = 2
-            self.rate_limit.requests_per_minute = 80
-            self.cors.allow_origins = ["https://staging.biothings.ai"]
-            
-        elif self.environment == Environment.DEVELOPMENT:
-            # Development settings (more permissive)
-            self.jwt.access_token_expire_hours = 24
-            self.rate_limit.requests_per_minute = 200
-            self.cors.allow_origins = ["http://localhost:3000", "http://127.0.0.1:3000"]
-            self.password_policy.min_length = 8
-            self.audit.log_all_requests = False
+        for path, value in self._PROFILES.get(self.environment, {}).items():
+            # Profile origins are tuples; each instance gets its own list
+            self._set_path(path, list(value) if isinstance(value, tuple) else value)
     
-    def validate_config(self) -> List[str]:
-        """Validate all configuration"""
-        errors = []
-        
+    def validate(self) -> Iterator[str]:
+        """Yield configuration errors lazily"""
         # Validate JWT config
-        errors.extend(self.jwt.validate())
+        yield from self.jwt.validate()
+        yield from self.audit.validate()
         
         # Validate database connection (basic checks)
         if not self.database.host:
-            errors.append("Database host is required")
+            yield "Database host is required"
         if not self.database.username:
-            errors.append("Database username is required")
+            yield "Database username is required"
         
         # Environment-specific validations
         if self.environment == Environment.PRODUCTION:
-            if self.jwt.secret_key == JWTConfig().secret_key:
-                errors.append("JWT secret key must be changed in production")
+            if self.jwt.secret_key == self._generated_jwt_key:
+                yield "JWT secret key must be changed in production"
             if not self.database.password:
-                errors.append("Database password is required in production")
-            if "localhost" in self.cors.allow_origins:
-                errors.append("Localhost should not be in CORS origins for production")
+                yield "Database password is required in production"
+            if not _LOOPBACK_HOSTS.isdisjoint(self.cors.origin_hosts):
+                yield "Localhost should not be in CORS origins for production"
+    
+    def validate_all(self) -> List[str]:
+        """Collect every configuration error"""
+        return list(self.validate())
+    
+    def validate_fast(self) -> Optional[str]:
+        """Return the first configuration error, if any"""
+        return next(self.validate(), None)
+    
+    def validate_config(self) -> List[str]:
+        """Validate all configuration"""
+        # Production stops at the first error when the config is valid, and
+        # otherwise collects every error so they can all be fixed at once
+        if self.environment == Environment.PRODUCTION:
+            if self.validate_fast() is None:
+                return []
+            errors = self.validate_all()
+            logger.error("Configuration validation failed", errors=errors)
+            raise ValueError(f"Production configuration errors: {errors}")
         
+        errors = self.validate_all()
         if errors:
             logger.error("Configuration validation failed", errors=errors)
-            if self.environment == Environment.PRODUCTION:
-                raise ValueError(f"Production configuration errors: {errors}")
         
         return errors
     
@@ -367,12 +604,21 @@ class SecurityConfigManager:
         # Ensure config directory exists
         self.config_dir.mkdir(exist_ok=True)
         
+        payload = orjson.dumps(secrets_data, option=orjson.OPT_INDENT_2)
+        tmp_file = self.secrets_file.with_name(self.secrets_file.name + ".tmp")
+        
         try:
-            with open(self.secrets_file, 'w') as f:
-                json.dump(secrets_data, f, indent=2)
-            
-            # Set restrictive permissions
-            os.chmod(self.secrets_file, 0o600)
+            # Create with restrictive permissions, then swap into place atomically
+            tmp_file.unlink(missing_ok=True)
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_file, self.secrets_file)
             
             logger.info("Secrets saved successfully", file=str(self.secrets_file))
             
@@ -409,7 +655,7 @@ class SecurityConfigManager:
     
     def rotate_secrets(self):
         """Rotate secrets (JWT key, etc.)"""
-        old_jwt_key = self.jwt.secret_key
+        old_key_hash = _key_fingerprint(self.jwt.secret_key)
         
         # Generate new JWT secret
         self.jwt.secret_key = secrets.token_urlsafe(32)
@@ -421,17 +667,31 @@ class SecurityConfigManager:
         
         return {
             "jwt_key_rotated": True,
-            "old_key_hash": hash(old_jwt_key),
-            "new_key_hash": hash(self.jwt.secret_key),
+            "old_key_hash": old_key_hash,
+            "new_key_hash": _key_fingerprint(self.jwt.secret_key),
             "rotation_time": datetime.utcnow().isoformat()
         }
 
 
+@lru_cache(maxsize=None)
+def _security_config_for(environment: Environment) -> SecurityConfigManager:
+    return SecurityConfigManager(environment)
+
+
 # Global configuration instance
 def get_security_config(environment: str = None) -> SecurityConfigManager:
-    """Get security configuration instance"""
-    env = Environment(environment) if environment else Environment.DEVELOPMENT
-    return SecurityConfigManager(env)
+    """Get security configuration instance (one shared manager per environment)
+    
+    Without an argument, the environment comes from BIOTHINGS_ENV.
+    """
+    env = Environment(environment) if environment else detect_environment()
+    return _security_config_for(env)
+
+
+def reload():
+    """Drop cached configuration managers and parsed secrets files"""
+    _SECRETS_CACHE.clear()
+    _security_config_for.cache_clear()
 
 
 # Environment detection
@@ -449,6 +709,13 @@ def detect_environment() -> Environment:
         return Environment.DEVELOPMENT
 
 
-# Create global config instance
-current_environment = detect_environment()
-security_config = get_security_config(current_environment.value)
\ No newline at end of file
+# Global config instance, created on first access (PEP 562)
+def __getattr__(name: str):
+    global current_environment, security_config
+    if name == "current_environment":
+        current_environment = detect_environment()
+        return current_environment
+    if name == "security_config":
+        security_config = get_security_config()
+        return security_config
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
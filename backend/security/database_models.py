@@ -3,15 +3,26 @@ Database Models for BioThings Security System
 Provides SQLAlchemy models and database operations for user management,
 sessions, audit logs, and security configurations
 """
+import os
 import uuid
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+import ipaddress
+import threading
+import time
+import hashlib
+import hmac
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import cached_property
+from typing import Iterator, List, Optional, Dict, Any, Tuple
 from sqlalchemy import (
-    create_engine, Column, String, DateTime, Boolean, Text, Integer, 
-    JSON, ForeignKey, Index, func, Enum as SQLEnum
+    create_engine, Column, String, DateTime, Boolean, Text, Integer, BigInteger,
+    JSON, LargeBinary, ForeignKey, Index, func, Enum as SQLEnum, bindparam, case, insert, select, update as sa_update
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy.orm import (
+    sessionmaker, scoped_session, relationship, deferred, selectinload, undefer_group,
+    validates, Session
+)
 from sqlalchemy.dialects.postgresql import UUID
 import enum
 import bcrypt
@@ -25,6 +36,53 @@ logger = structlog.get_logger()
 Base = declarative_base()
 
 
+def _epoch_ms(value: datetime) -> int:
+    """Epoch milliseconds for a datetime (naive values are treated as UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+# Keyed Bloom filter over the password history: 1024 bits, 8 probes per password.
+# Stored value is a 4-byte key id followed by the 128-byte bit array.
+_HISTORY_FILTER_BITS = 1024
+_HISTORY_FILTER_KEY = os.getenv("PASSWORD_HISTORY_KEY", "").encode('utf-8')
+_HISTORY_FILTER_KEY_ID = hashlib.sha256(_HISTORY_FILTER_KEY).digest()[:4]
+
+
+def _history_filter_positions(password: str) -> Optional[List[int]]:
+    """Bloom filter bit positions for a password, or None if no key is configured"""
+    if not _HISTORY_FILTER_KEY:
+        return None
+    digest = hmac.new(_HISTORY_FILTER_KEY, password.lower().encode('utf-8'), hashlib.sha256).digest()
+    return [int.from_bytes(digest[i:i + 4], 'big') % _HISTORY_FILTER_BITS for i in range(0, 32, 4)]
+
+
+def _build_history_filter(entries) -> Optional[bytes]:
+    """Rebuild the filter from history entries; None if any entry lacks positions"""
+    bits = bytearray(_HISTORY_FILTER_BITS // 8)
+    for entry in entries:
+        positions = entry.get('bloom')
+        if positions is None:
+            return None
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+    return _HISTORY_FILTER_KEY_ID + bytes(bits)
+
+
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 version 7): 48-bit ms timestamp + random bits"""
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # Version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+    return uuid.UUID(int=value)
+
+
+def token_digest(token: str) -> bytes:
+    """Fixed-size digest stored and indexed in place of raw session tokens"""
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=32).digest()
+
+
 class UserStatus(enum.Enum):
     """User account status"""
     ACTIVE = "active"
@@ -45,7 +103,7 @@ class User(Base):
     __tablename__ = "users"
     
     # Primary identification
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     username = Column(String(50), unique=True, nullable=False, index=True)
     email = Column(String(255), unique=True, nullable=False, index=True)
     
@@ -56,16 +114,17 @@ class User(Base):
     # User information
     first_name = Column(String(100))
     last_name = Column(String(100))
-    role = Column(SQLEnum(UserRole), nullable=False, default=UserRole.OBSERVER)
+    role_value = Column('role', String(32), nullable=False, default=UserRole.OBSERVER.value)
     
     # Account status
-    status = Column(SQLEnum(UserStatus), nullable=False, default=UserStatus.ACTIVE)
+    status_value = Column('status', String(32), nullable=False, default=UserStatus.ACTIVE.value)
     is_active = Column(Boolean, default=True, nullable=False)
     is_verified = Column(Boolean, default=False, nullable=False)
     
     # Security tracking
     failed_login_attempts = Column(Integer, default=0, nullable=False)
     account_locked_until = Column(DateTime(timezone=True))
+    account_locked_until_ts = Column(BigInteger)  # Same instant as epoch milliseconds
     last_login = Column(DateTime(timezone=True))
     last_password_change = Column(DateTime(timezone=True))
     
@@ -74,13 +133,14 @@ class User(Base):
     updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
     created_by = Column(UUID(as_uuid=True), ForeignKey("users.id"))
     
-    # Additional security fields
+    # Additional security fields (deferred: not needed on the login path)
     two_factor_enabled = Column(Boolean, default=False)
-    two_factor_secret = Column(String(255))
-    backup_codes = Column(JSON)  # Array of backup codes
+    two_factor_secret = deferred(Column(String(255)), group='security')
+    backup_codes = deferred(Column(JSON), group='security')  # Array of backup codes
     
     # Password history for policy enforcement
-    password_history = Column(JSON)  # Array of previous password hashes
+    password_history = deferred(Column(JSON), group='security')  # Array of previous password hashes
+    password_history_filter = deferred(Column(LargeBinary(132)), group='security')  # Bloom filter over history
     
     # Preferences and metadata
     preferences = Column(JSON, default=dict)
@@ -100,6 +160,23 @@ class User(Base):
         Index('idx_user_created_at', 'created_at'),
     )
     
+    # Role and status are stored as plain strings and boxed into enums on access
+    @property
+    def role(self) -> Optional[UserRole]:
+        return UserRole(self.role_value) if self.role_value else None
+    
+    @role.setter
+    def role(self, value) -> None:
+        self.role_value = UserRole(value).value
+    
+    @property
+    def status(self) -> Optional[UserStatus]:
+        return UserStatus(self.status_value) if self.status_value else None
+    
+    @status.setter
+    def status(self, value) -> None:
+        self.status_value = UserStatus(value).value
+    
     def set_password(self, password: str) -> None:
         """Set user password with proper hashing"""
         # Generate salt and hash password
@@ -108,20 +185,25 @@ class User(Base):
         
         self.password_salt = salt.decode('utf-8')
         self.password_hash = password_hash.decode('utf-8')
-        self.last_password_change = datetime.utcnow()
-        
-        # Update password history
-        if not self.password_history:
-            self.password_history = []
+        now = datetime.utcnow()
+        self.last_password_change = now
         
-        self.password_history.append({
+        # Update password history, keeping only the last 5 passwords
+        history = deque(self.password_history or (), maxlen=5)
+        entry = {
             'hash': self.password_hash,
-            'changed_at': datetime.utcnow().isoformat()
-        })
+            'changed_at': now.isoformat()
+        }
+        positions = _history_filter_positions(password)
+        if positions is not None:
+            entry['bloom'] = positions
+        history.append(entry)
         
-        # Keep only last 5 passwords
-        if len(self.password_history) > 5:
-            self.password_history = self.password_history[-5:]
+        # Assign a new list so the JSON column is flagged as modified
+        self.password_history = list(history)
+        self.password_history_filter = (
+            _build_history_filter(history) if positions is not None else None
+        )
     
     def verify_password(self, password: str) -> bool:
         """Verify password against stored hash"""
@@ -135,39 +217,59 @@ class User(Base):
         if not self.password_history:
             return False
         
+        # Bloom filter rules out most new passwords without touching the entries
+        history_filter = self.password_history_filter
+        if history_filter and history_filter[:4] == _HISTORY_FILTER_KEY_ID:
+            positions = _history_filter_positions(password)
+            if positions is not None and not all(
+                history_filter[4 + (position >> 3)] & (1 << (position & 7))
+                for position in positions
+            ):
+                return False
+        
+        password_bytes = password.encode('utf-8')
         for hist_entry in self.password_history:
-            if bcrypt.checkpw(password.encode('utf-8'), hist_entry['hash'].encode('utf-8')):
+            if bcrypt.checkpw(password_bytes, hist_entry['hash'].encode('utf-8')):
                 return True
         return False
     
-    def lock_account(self, duration_minutes: int = 30) -> None:
+    def lock_account(self, duration_minutes: int = 30, now: Optional[datetime] = None) -> None:
         """Lock user account for specified duration"""
-        self.account_locked_until = datetime.utcnow() + timedelta(minutes=duration_minutes)
+        self.account_locked_until = (now or datetime.utcnow()) + timedelta(minutes=duration_minutes)
+        self.account_locked_until_ts = _epoch_ms(self.account_locked_until)
         self.status = UserStatus.SUSPENDED
     
     def unlock_account(self) -> None:
         """Unlock user account"""
         self.account_locked_until = None
+        self.account_locked_until_ts = None
         self.failed_login_attempts = 0
         if self.status == UserStatus.SUSPENDED:
             self.status = UserStatus.ACTIVE
     
-    def is_locked(self) -> bool:
+    def is_locked(self, now: Optional[datetime] = None) -> bool:
         """Check if account is currently locked"""
+        locked_until_ts = self.account_locked_until_ts
+        if locked_until_ts is not None:
+            now_ms = _epoch_ms(now) if now else time.time_ns() // 1_000_000
+            return now_ms < locked_until_ts
+        
+        # Rows locked before the epoch column existed
         if not self.account_locked_until:
             return False
-        return datetime.utcnow() < self.account_locked_until
+        return (now or datetime.utcnow()) < self.account_locked_until
     
-    def record_login_attempt(self, success: bool, ip_address: str) -> None:
+    def record_login_attempt(self, success: bool, ip_address: str,
+                             now: Optional[datetime] = None) -> None:
         """Record login attempt"""
         if success:
             self.failed_login_attempts = 0
-            self.last_login = datetime.utcnow()
+            self.last_login = now or datetime.utcnow()
             self.unlock_account()
         else:
             self.failed_login_attempts += 1
     
-    def to_dict(self) -> Dict[str, Any]:
+    def to_dict(self, now: Optional[datetime] = None) -> Dict[str, Any]:
         """Convert user to dictionary"""
         return {
             'id': str(self.id),
@@ -175,14 +277,14 @@ class User(Base):
             'email': self.email,
             'first_name': self.first_name,
             'last_name': self.last_name,
-            'role': self.role.value if self.role else None,
-            'status': self.status.value if self.status else None,
+            'role': self.role_value,
+            'status': self.status_value,
             'is_active': self.is_active,
             'is_verified': self.is_verified,
             'two_factor_enabled': self.two_factor_enabled,
             'last_login': self.last_login.isoformat() if self.last_login else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'is_locked': self.is_locked()
+            'is_locked': self.is_locked(now)
         }
 
 
@@ -190,15 +292,15 @@ class UserSession(Base):
     """User session model for tracking active sessions"""
     __tablename__ = "user_sessions"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     
-    # Session identification
-    session_token = Column(String(255), unique=True, nullable=False, index=True)
-    refresh_token = Column(String(255), unique=True, nullable=False, index=True)
+    # Session identification (token_digest of the raw tokens)
+    session_token = Column(LargeBinary(32), unique=True, nullable=False, index=True)
+    refresh_token = Column(LargeBinary(32), unique=True, nullable=False, index=True)
     
     # Session information
-    status = Column(SQLEnum(SessionStatus), default=SessionStatus.ACTIVE, nullable=False)
+    status = Column(SQLEnum(SessionStatus, native_enum=True), default=SessionStatus.ACTIVE, nullable=False)
     created_at = Column(DateTime(timezone=True), default=func.now(), nullable=False)
     expires_at = Column(DateTime(timezone=True), nullable=False)
     last_activity = Column(DateTime(timezone=True), default=func.now())
@@ -220,33 +322,36 @@ class UserSession(Base):
     __table_args__ = (
         Index('idx_session_user_status', 'user_id', 'status'),
         Index('idx_session_expires_status', 'expires_at', 'status'),
+        Index('idx_session_token_active', 'session_token',
+              postgresql_where=(status == SessionStatus.ACTIVE)),
         Index('idx_session_client_ip', 'client_ip'),
     )
     
-    def is_expired(self) -> bool:
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
         """Check if session is expired"""
-        return datetime.utcnow() > self.expires_at
+        return (now or datetime.utcnow()) > self.expires_at
     
-    def is_active(self) -> bool:
+    def is_active(self, now: Optional[datetime] = None) -> bool:
         """Check if session is active"""
-        return self.status == SessionStatus.ACTIVE and not self.is_expired()
+        return self.status == SessionStatus.ACTIVE and not self.is_expired(now)
     
     def terminate(self) -> None:
         """Terminate session"""
         self.status = SessionStatus.TERMINATED
     
-    def extend_expiry(self, hours: int = 24) -> None:
+    def extend_expiry(self, hours: int = 24, now: Optional[datetime] = None) -> None:
         """Extend session expiry"""
-        if self.is_active():
-            self.expires_at = datetime.utcnow() + timedelta(hours=hours)
-            self.last_activity = datetime.utcnow()
+        now = now or datetime.utcnow()
+        if self.is_active(now):
+            self.expires_at = now + timedelta(hours=hours)
+            self.last_activity = now
 
 
 class APIKey(Base):
     """API key model for programmatic access"""
     __tablename__ = "api_keys"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     
     # Key information
@@ -276,14 +381,15 @@ class APIKey(Base):
     # Indexes
     __table_args__ = (
         Index('idx_apikey_user_active', 'user_id', 'is_active'),
+        Index('idx_apikey_hash_active', 'key_hash', postgresql_where=is_active.is_(True)),
         Index('idx_apikey_expires', 'expires_at'),
     )
     
-    def is_expired(self) -> bool:
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
         """Check if API key is expired"""
         if not self.expires_at:
             return False
-        return datetime.utcnow() > self.expires_at
+        return (now or datetime.utcnow()) > self.expires_at
     
     def is_usage_exceeded(self) -> bool:
         """Check if usage limit is exceeded"""
@@ -291,37 +397,68 @@ class APIKey(Base):
             return False
         return self.usage_count >= self.usage_limit
     
-    def is_valid(self) -> bool:
+    def is_valid(self, now: Optional[datetime] = None) -> bool:
         """Check if API key is valid for use"""
         return (
             self.is_active and 
-            not self.is_expired() and 
+            not self.is_expired(now) and 
             not self.is_usage_exceeded()
         )
     
-    def record_usage(self, ip_address: str) -> None:
+    def record_usage(self, ip_address: str, now: Optional[datetime] = None) -> None:
         """Record API key usage"""
         self.usage_count += 1
-        self.last_used = datetime.utcnow()
+        self.last_used = now or datetime.utcnow()
+    
+    @validates('allowed_ips')
+    def _reset_allowed_ip_cache(self, key: str, value):
+        self.__dict__.pop('allowed_ip_set', None)
+        return value
+    
+    @cached_property
+    def allowed_ip_set(self) -> Tuple[frozenset, tuple]:
+        """Parsed whitelist: exact addresses and CIDR networks"""
+        exact = []
+        networks = []
+        for entry in self.allowed_ips or ():
+            if '/' in entry:
+                try:
+                    networks.append(ipaddress.ip_network(entry, strict=False))
+                except ValueError:
+                    logger.warning("Ignoring invalid API key network", network=entry)
+            else:
+                exact.append(entry)
+        return frozenset(exact), tuple(networks)
     
     def can_access_from_ip(self, ip_address: str) -> bool:
         """Check if IP is allowed to use this key"""
         if not self.allowed_ips:
             return True
-        return ip_address in self.allowed_ips
+        
+        exact, networks = self.allowed_ip_set
+        if ip_address in exact:
+            return True
+        if not networks:
+            return False
+        
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+        return any(address in network for network in networks)
 
 
 class AuditEvent(Base):
     """Audit event model for security logging"""
     __tablename__ = "audit_events"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     
     # Event identification
     event_id = Column(String(100), unique=True, nullable=False, index=True)
     event_type = Column(String(100), nullable=False, index=True)
-    category = Column(SQLEnum(EventCategory), nullable=False, index=True)
-    severity = Column(SQLEnum(EventSeverity), nullable=False, index=True)
+    category = Column(SQLEnum(EventCategory, native_enum=True), nullable=False, index=True)
+    severity = Column(SQLEnum(EventSeverity, native_enum=True), nullable=False, index=True)
     
     # Event details
     message = Column(Text, nullable=False)
@@ -389,21 +526,64 @@ class SecurityConfiguration(Base):
     creator = relationship("User")
 
 
+# Failed logins before an account is locked, and for how long
+MAX_FAILED_LOGIN_ATTEMPTS = 5
+LOCKOUT_DURATION_MINUTES = 30
+
+# Hot lookup statements, built once and reused with new bind values
+_USER_BY_USERNAME = select(User).where(User.username == bindparam('username'))
+_USER_BY_EMAIL = select(User).where(User.email == bindparam('email'))
+# Users handed to callers are detached from their session and cannot load
+# deferred columns later, so those lookups load the security group up front
+_WITH_SECURITY_FIELDS = undefer_group('security')
+_DETACHED_USER_BY_USERNAME = _USER_BY_USERNAME.options(_WITH_SECURITY_FIELDS)
+_DETACHED_USER_BY_EMAIL = _USER_BY_EMAIL.options(_WITH_SECURITY_FIELDS)
+_ACTIVE_SESSION_BY_TOKEN = select(UserSession).where(
+    UserSession.session_token == bindparam('token_digest'),
+    UserSession.status == SessionStatus.ACTIVE,
+    UserSession.expires_at > bindparam('now')
+)
+
+
 class DatabaseManager:
     """Database operations manager"""
     
-    def __init__(self, database_url: str):
+    def __init__(self,
+                 database_url: str,
+                 pool_size: int = 25,
+                 max_overflow: int = 25,
+                 pool_timeout: int = 30,
+                 pool_recycle: int = 1800,
+                 create_tables: bool = False):
         self.engine = create_engine(
             database_url,
-            pool_size=10,
-            max_overflow=20,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,  # Seconds before a connection is replaced
+            pool_use_lifo=True,  # Reuse the most recently returned (warm) connection
             pool_pre_ping=True,
+            query_cache_size=1200,
             echo=False  # Set to True for SQL debugging
         )
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # One reusable session per thread instead of a new Session per call
+        self.SessionLocal = scoped_session(
+            sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        )
         
-        # Create tables
-        self.create_tables()
+        # Audit events are buffered and written in multi-row INSERTs
+        self._audit_queue: deque = deque()
+        self._audit_flush_every = 100
+        self._audit_flush_interval = 1.0  # Seconds
+        self._audit_flush_lock = threading.Lock()
+        self._audit_flusher: Optional[threading.Thread] = None
+        self._audit_flusher_stop = threading.Event()
+        self._audit_flush_wanted = threading.Event()
+        self.dropped_audit_events = 0
+        
+        # Create tables only on request (e.g. development); production schemas are migrated
+        if create_tables or os.getenv("BIOTHINGS_DEV") == "1":
+            self.create_tables()
         
         logger.info("Database manager initialized", url=database_url.split('@')[0] + '@***')
     
@@ -424,7 +604,9 @@ class DatabaseManager:
         
         with self.get_session() as db:
             # Check if admin already exists
-            existing_admin = db.query(User).filter(User.username == username).first()
+            existing_admin = db.execute(
+                _DETACHED_USER_BY_USERNAME, {'username': username}
+            ).scalar_one_or_none()
             if existing_admin:
                 logger.info("Admin user already exists", username=username)
                 return existing_admin
@@ -445,7 +627,7 @@ class DatabaseManager:
             
             db.add(admin_user)
             db.commit()
-            db.refresh(admin_user)
+            admin_user = self._load_detached_user(db, admin_user.id)
             
             logger.warning(
                 "Default admin user created - CHANGE PASSWORD IN PRODUCTION!",
@@ -458,17 +640,28 @@ class DatabaseManager:
     def get_user_by_username(self, username: str) -> Optional[User]:
         """Get user by username"""
         with self.get_session() as db:
-            return db.query(User).filter(User.username == username).first()
+            return db.execute(_DETACHED_USER_BY_USERNAME, {'username': username}).scalar_one_or_none()
     
     def get_user_by_email(self, email: str) -> Optional[User]:
         """Get user by email"""
         with self.get_session() as db:
-            return db.query(User).filter(User.email == email).first()
+            return db.execute(_DETACHED_USER_BY_EMAIL, {'email': email}).scalar_one_or_none()
     
     def get_user_by_id(self, user_id: str) -> Optional[User]:
         """Get user by ID"""
+        try:
+            user_uuid = user_id if isinstance(user_id, uuid.UUID) else uuid.UUID(user_id)
+        except ValueError:
+            return None
+        
+        # Primary key lookup can be served from the identity map
         with self.get_session() as db:
-            return db.query(User).filter(User.id == user_id).first()
+            return db.get(User, user_uuid, options=[_WITH_SECURITY_FIELDS])
+    
+    @staticmethod
+    def _load_detached_user(db: Session, user_id) -> User:
+        """Reload a just-committed user with every column the caller may read"""
+        return db.get(User, user_id, options=[_WITH_SECURITY_FIELDS], populate_existing=True)
     
     def create_user(self, user_data: Dict[str, Any]) -> User:
         """Create new user"""
@@ -479,41 +672,62 @@ class DatabaseManager:
             
             db.add(user)
             db.commit()
-            db.refresh(user)
             
-            return user
+            return self._load_detached_user(db, user.id)
     
     def authenticate_user(self, username: str, password: str, ip_address: str) -> Optional[User]:
         """Authenticate user and record attempt"""
         with self.get_session() as db:
-            user = db.query(User).filter(User.username == username).first()
+            user = db.execute(_USER_BY_USERNAME, {'username': username}).scalar_one_or_none()
             
             if not user:
                 return None
             
             # Check if account is locked
-            if user.is_locked():
-                user.record_login_attempt(False, ip_address)
-                db.commit()
+            now = datetime.utcnow()
+            if user.is_locked(now):
+                self._record_failed_login(db, user.id, now, can_lock=False)
                 return None
             
             # Verify password
             if user.verify_password(password):
-                user.record_login_attempt(True, ip_address)
+                user.record_login_attempt(True, ip_address, now)
                 db.commit()
                 return user
             else:
-                user.record_login_attempt(False, ip_address)
-                
-                # Lock account if too many failed attempts
-                if user.failed_login_attempts >= 5:
-                    user.lock_account()
-                
-                db.commit()
+                self._record_failed_login(db, user.id, now, can_lock=True)
                 return None
     
+    def _record_failed_login(self, db: Session, user_id, now: datetime, can_lock: bool) -> None:
+        """Count a failed login (and lock if over the limit) in one atomic UPDATE"""
+        table = User.__table__
+        attempts = table.c.failed_login_attempts + 1
+        values = {'failed_login_attempts': attempts}
+        
+        if can_lock:
+            over_limit = attempts >= MAX_FAILED_LOGIN_ATTEMPTS
+            values['status'] = case(
+                (over_limit, UserStatus.SUSPENDED.value), else_=table.c.status
+            )
+            locked_until = now + timedelta(minutes=LOCKOUT_DURATION_MINUTES)
+            values['account_locked_until'] = case(
+                (over_limit, locked_until), else_=table.c.account_locked_until
+            )
+            values['account_locked_until_ts'] = case(
+                (over_limit, _epoch_ms(locked_until)), else_=table.c.account_locked_until_ts
+            )
+        
+        stmt = sa_update(table).where(table.c.id == user_id).values(**values)
+        db.execute(stmt.execution_options(synchronize_session=False))
+        db.commit()
+    
     def create_session(self, user_id: str, session_data: Dict[str, Any]) -> UserSession:
         """Create user session"""
+        session_data = dict(session_data)
+        for token_field in ('session_token', 'refresh_token'):
+            if isinstance(session_data.get(token_field), str):
+                session_data[token_field] = token_digest(session_data[token_field])
+        
         with self.get_session() as db:
             session = UserSession(user_id=user_id, **session_data)
             db.add(session)
@@ -523,72 +737,179 @@ class DatabaseManager:
     
     def get_active_session(self, session_token: str) -> Optional[UserSession]:
         """Get active session by token"""
+        # Expired rows are filtered out here and marked by cleanup_expired_sessions
+        params = {'token_digest': token_digest(session_token), 'now': datetime.utcnow()}
+        
         with self.get_session() as db:
-            session = db.query(UserSession).filter(
-                UserSession.session_token == session_token,
-                UserSession.status == SessionStatus.ACTIVE
-            ).first()
-            
-            if session and session.is_expired():
-                session.status = SessionStatus.EXPIRED
-                db.commit()
-                return None
-            
-            return session
+            return db.execute(_ACTIVE_SESSION_BY_TOKEN, params).scalar_one_or_none()
     
     def cleanup_expired_sessions(self) -> int:
         """Clean up expired sessions"""
+        # Core bulk UPDATE; no session objects need synchronizing
+        stmt = sa_update(UserSession.__table__).where(
+            UserSession.status == SessionStatus.ACTIVE,
+            UserSession.expires_at < datetime.utcnow()
+        ).values(status=SessionStatus.EXPIRED)
+        
         with self.get_session() as db:
-            expired_count = db.query(UserSession).filter(
-                UserSession.status == SessionStatus.ACTIVE,
-                UserSession.expires_at < datetime.utcnow()
-            ).update({'status': SessionStatus.EXPIRED})
-            
+            result = db.execute(stmt.execution_options(synchronize_session=False))
             db.commit()
-            return expired_count
+            return result.rowcount
+    
+    def log_audit_event(self, event_data: Dict[str, Any]) -> None:
+        """Queue audit event for the next batched database write"""
+        if 'timestamp' not in event_data:
+            # The column default would record when the batch was written instead
+            event_data = {**event_data, 'timestamp': datetime.utcnow()}
+        self._audit_queue.append(event_data)
+        
+        # Time-based flushes belong to the flusher; a full queue only wakes it early
+        if len(self._audit_queue) >= self._audit_flush_every:
+            if self._audit_flusher is not None:
+                self._audit_flush_wanted.set()
+            else:
+                self.flush_audit_events()
     
-    def log_audit_event(self, event_data: Dict[str, Any]) -> AuditEvent:
-        """Log audit event to database"""
+    def flush_audit_events(self) -> int:
+        """Write all queued audit events, one INSERT per distinct column set
+        
+        If the batched INSERT fails, the batch is retried row by row so one
+        bad event does not take the rest with it. Returns the number of
+        events written.
+        """
+        with self._audit_flush_lock:
+            batch = []
+            while self._audit_queue:
+                batch.append(self._audit_queue.popleft())
+            
+            if not batch:
+                return 0
+            
+            # executemany needs identical keys in every row; omitted columns keep their defaults
+            groups: Dict[frozenset, List[Dict[str, Any]]] = {}
+            for event_data in batch:
+                groups.setdefault(frozenset(event_data), []).append(event_data)
+            
+            try:
+                with self.get_session() as db:
+                    for rows in groups.values():
+                        db.execute(insert(AuditEvent.__table__), rows)
+                    db.commit()
+                return len(batch)
+            except Exception as e:
+                logger.warning("Batched audit insert failed, retrying row by row",
+                               error=str(e), count=len(batch))
+            
+            return self._insert_audit_rows(batch)
+    
+    def _insert_audit_rows(self, batch: List[Dict[str, Any]]) -> int:
+        """Insert audit events one at a time, dropping only the ones that fail"""
+        written = 0
         with self.get_session() as db:
-            event = AuditEvent(**event_data)
-            db.add(event)
-            db.commit()
-            db.refresh(event)
-            return event
+            for event_data in batch:
+                try:
+                    db.execute(insert(AuditEvent.__table__), event_data)
+                    db.commit()
+                    written += 1
+                except Exception as e:
+                    db.rollback()
+                    self.dropped_audit_events += 1
+                    logger.error("Failed to write audit event", error=str(e),
+                                 event_id=event_data.get('event_id'))
+        return written
+    
+    def start_audit_flusher(self) -> None:
+        """Flush queued audit events every few seconds from a background thread
+        
+        Without it, queued events are only written once the queue fills,
+        and each full queue is written on the request that filled it.
+        """
+        if self._audit_flusher is not None:
+            return
+        
+        self._audit_flusher_stop.clear()
+        self._audit_flush_wanted.clear()
+        self._audit_flusher = threading.Thread(
+            target=self._run_audit_flusher, name="audit-flush", daemon=True
+        )
+        self._audit_flusher.start()
+    
+    def stop_audit_flusher(self) -> None:
+        """Stop the background flusher and write anything still queued"""
+        if self._audit_flusher is not None:
+            self._audit_flusher_stop.set()
+            self._audit_flush_wanted.set()
+            self._audit_flusher.join()
+            self._audit_flusher = None
+        
+        self.flush_audit_events()
+    
+    def _run_audit_flusher(self) -> None:
+        while not self._audit_flusher_stop.is_set():
+            self._audit_flush_wanted.wait(self._audit_flush_interval)
+            self._audit_flush_wanted.clear()
+            if self._audit_flusher_stop.is_set() or not self._audit_queue:
+                continue
+            try:
+                self.flush_audit_events()
+            except Exception as e:
+                logger.error("Audit flush failed", error=str(e))
     
     def get_audit_events(self,
                         user_id: Optional[str] = None,
                         start_time: Optional[datetime] = None,
                         end_time: Optional[datetime] = None,
                         event_types: Optional[List[str]] = None,
-                        limit: int = 1000) -> List[AuditEvent]:
-        """Query audit events"""
-        with self.get_session() as db:
-            query = db.query(AuditEvent)
-            
-            if user_id:
-                query = query.filter(AuditEvent.user_id == user_id)
-            
-            if start_time:
-                query = query.filter(AuditEvent.timestamp >= start_time)
-            
-            if end_time:
-                query = query.filter(AuditEvent.timestamp <= end_time)
-            
-            if event_types:
-                query = query.filter(AuditEvent.event_type.in_(event_types))
-            
-            return query.order_by(AuditEvent.timestamp.desc()).limit(limit).all()
+                        limit: int = 1000,
+                        columns: Optional[List[str]] = None,
+                        load_user: bool = False) -> Iterator[Any]:
+        """Stream audit events, newest first
+        
+        Yields AuditEvent objects, or plain rows of the requested columns
+        when ``columns`` is given. Wrap in list() to materialize. Pass
+        ``load_user=True`` when callers read ``event.user`` to fetch users
+        in one batched query instead of one per event.
+        """
+        if columns:
+            table = AuditEvent.__table__
+            stmt = select(*(table.c[name] for name in columns))
+        else:
+            stmt = select(AuditEvent)
+            if load_user:
+                stmt = stmt.options(selectinload(AuditEvent.user))
+        
+        if user_id:
+            stmt = stmt.where(AuditEvent.user_id == user_id)
+        
+        if start_time:
+            stmt = stmt.where(AuditEvent.timestamp >= start_time)
+        
+        if end_time:
+            stmt = stmt.where(AuditEvent.timestamp <= end_time)
+        
+        if event_types:
+            stmt = stmt.where(AuditEvent.event_type.in_(event_types))
+        
+        stmt = stmt.order_by(AuditEvent.timestamp.desc()).limit(limit)
+        stmt = stmt.execution_options(yield_per=200)
+        
+        # Make queued events visible to this query
+        self.flush_audit_events()
+        
+        # Dedicated session: the thread's scoped session may be reused while this streams
+        with self.SessionLocal.session_factory() as db:
+            result = db.execute(stmt)
+            yield from (result if columns else result.scalars())
 
 
 # Global database manager instance (will be initialized with actual database URL)
 db_manager: Optional[DatabaseManager] = None
 
 
-def initialize_database(database_url: str) -> DatabaseManager:
+def initialize_database(database_url: str, **options: Any) -> DatabaseManager:
     """Initialize database manager"""
     global db_manager
-    db_manager = DatabaseManager(database_url)
+    db_manager = DatabaseManager(database_url, **options)
     return db_manager
 
 
@@ -3,18 +3,18 @@ Example Integration of BioThings Security System
 This file shows how to integrate the security system with the existing main.py
 """
 import os
+import asyncio
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, Depends, HTTPException, status
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Tuple
 
 # Import security components
 from security import (
     # Core security
-    SecurityMiddleware,
-    ValidationMiddleware, 
-    AuditMiddleware,
+    SecurityPipelineMiddleware,
     security_manager,
     audit_logger,
     input_validator,
@@ -25,9 +25,12 @@ from security import (
     require_admin,
     require_scientist,
     User,
+    ClientInfo,
+    get_client_info,
+    request_client_info,
     
     # Configuration
-    security_config,
+    get_security_config,
     Environment,
     
     # Monitoring
@@ -35,7 +38,8 @@ from security import (
     security_monitor,
     
     # Database
-    initialize_database
+    initialize_database,
+    get_database
 )
 
 # Import existing BioThings modules
@@ -48,41 +52,155 @@ from app.core.messaging import message_broker
 from app.core.llm import llm_service
 from app.workflows.biotech_workflows import workflow_engine
 from app.analytics.metrics_engine import metrics_engine
+import jwt
+import orjson
 import structlog
 
 logger = structlog.get_logger()
 
+security_config = get_security_config()
 
-@asynccontextmanager
-async def secure_lifespan(app: FastAPI):
-    """Secure application lifespan with security initialization"""
-    # Startup
-    logger.info("Starting secure BioThings application", environment=security_config.environment.value)
-    
-    # Initialize database if URL is provided
+
+def _build_root_payload(app: FastAPI, monitoring: bool) -> bytes:
+    """Serialize the root response for one security monitor state.
+    
+    The closing brace is left off so the timestamp can be appended per request.
+    """
+    return orjson.dumps({
+        "name": "BioThings Secure API",
+        "version": "1.0.0",
+        "status": "operational",
+        "security": {
+            "environment": security_config.environment.value,
+            "authentication": "enabled",
+            "rate_limiting": "enabled",
+            "audit_logging": "enabled",
+            "monitoring": monitoring
+        },
+        "features": {
+            "llm_model": llm_service.model if hasattr(llm_service, 'model') else "gemini-2.5-flash",
+            "agents_active": len(app.state.agents),
+            "workflows_available": len(workflow_engine.protocols) if hasattr(workflow_engine, 'protocols') else 0
+        }
+    })[:-1]
+
+
+def _encode_agent_statuses(agents: Dict[str, Any]) -> bytes:
+    """Serialize the /api/agents response body"""
+    return orjson.dumps(
+        {"agents": [agent.get_status() for agent in agents.values()]},
+        default=str
+    )
+
+
+# Route dependencies, shared by every endpoint that needs them
+CURRENT_USER = Depends(get_current_user)
+SCIENTIST = Depends(require_scientist)
+ADMIN = Depends(require_admin)
+CLIENT_INFO = Depends(get_client_info)
+
+# Longest free-text value copied into a security event
+_MAX_AUDIT_FIELD_LENGTH = 100
+
+# Summaries polled by health probes and the admin dashboard are recomputed at
+# most every _SUMMARY_TTL_SECONDS
+_SUMMARY_TTL_SECONDS = 2.0
+_summary_cache: Dict[str, Tuple[float, Any]] = {}
+
+
+def _cached_summary(name: str, producer: Callable[[], Any]) -> Any:
+    """Return a recently computed summary, calling producer once it has expired"""
+    now = time.monotonic()
+    entry = _summary_cache.get(name)
+    if entry and entry[0] > now:
+        return entry[1]
+    
+    value = producer()
+    _summary_cache[name] = (now + _SUMMARY_TTL_SECONDS, value)
+    return value
+
+
+def _utc_now_iso() -> str:
+    """Current UTC time as an ISO string, truncated to the second"""
+    return datetime.utcnow().replace(microsecond=0).isoformat()
+
+
+def _health_services(app: FastAPI) -> Dict[str, Any]:
+    """Snapshot of service status reported by the health check"""
+    return {
+        "message_broker": message_broker.is_connected,
+        "llm_service": bool(llm_service.llm),
+        "agents": len(app.state.agents),
+        "active_experiments": workflow_engine.active_count,
+        "security_monitor": security_monitor.is_running,
+        "audit_logger": audit_logger is not None
+    }
+
+
+async def _run_ticker(app: FastAPI, interval: float = 0.25):
+    """Refresh per-second state shared by request handlers"""
+    while True:
+        try:
+            await asyncio.sleep(interval)
+            app.state.now_iso = _utc_now_iso()
+            app.state.health_services = _health_services(app)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error("Ticker failed", error=str(e))
+
+
+def _initialize_database():
+    """Initialize the database and default admin if a URL is provided"""
     db_url = os.getenv("DATABASE_URL") or security_config.database.url
     if db_url and db_url != "postgresql://biothings_user:@localhost:5432/biothings?sslmode=prefer":
         try:
-            db_manager = initialize_database(db_url)
+            db_manager = initialize_database(
+                db_url,
+                create_tables=security_config.environment != Environment.PRODUCTION
+            )
             # Create default admin user
             db_manager.create_default_admin()
+            db_manager.start_audit_flusher()
             logger.info("Database initialized successfully")
         except Exception as e:
             logger.warning("Database initialization failed", error=str(e))
-    
-    # Start security monitoring
+
+
+async def _start_security_monitor():
+    """Start security monitoring"""
     try:
         await security_monitor.start()
         logger.info("Security monitoring started")
     except Exception as e:
         logger.warning("Security monitoring failed to start", error=str(e))
-    
-    # Connect to message broker (optional)
+
+
+async def _connect_message_broker():
+    """Connect to message broker (optional)"""
     try:
         await message_broker.connect()
         logger.info("Message broker connected")
     except Exception as e:
         logger.warning(f"Redis not available: {e}. Running without message broker.")
+
+
+@asynccontextmanager
+async def secure_lifespan(app: FastAPI):
+    """Secure application lifespan with security initialization"""
+    # Startup
+    logger.info("Starting secure BioThings application", environment=security_config.environment.value)
+    
+    # Database setup, monitoring and the broker connection are independent,
+    # so bring them up concurrently; the blocking database setup runs in a thread
+    await asyncio.gather(
+        asyncio.to_thread(_initialize_database),
+        _start_security_monitor(),
+        _connect_message_broker()
+    )
+    
+    # Publish broker notifications from request handlers in the background
+    await message_broker.start_publisher()
     
     # Initialize agents
     agents = {
@@ -95,9 +213,36 @@ async def secure_lifespan(app: FastAPI):
     
     # Store agents in app state
     app.state.agents = agents
+    # One encoding per monitor state; the handler picks the current one
+    app.state.root_payloads = {
+        monitoring: _build_root_payload(app, monitoring) for monitoring in (True, False)
+    }
+    
+    # Keep the agents listing encoded, re-encoding only when an agent's status changes
+    def refresh_agents_status(agent=None):
+        app.state.agents_status = _encode_agent_statuses(agents)
+    
+    for agent in agents.values():
+        agent.status_listeners.append(refresh_agents_status)
+    refresh_agents_status()
+    
+    # Handlers read the timestamp and service status refreshed by the ticker
+    # instead of computing their own
+    app.state.now_iso = _utc_now_iso()
+    app.state.health_services = _health_services(app)
+    ticker = asyncio.create_task(_run_ticker(app))
+    
+    # Start background audit and security event recording
+    security_manager.set_min_severity(security_config.audit.min_severity)
+    await audit_logger.start()
+    await security_manager.start_event_consumer(
+        max_pending_events=security_config.audit.buffer_size,
+        batch_size=security_config.audit.batch_size,
+        flush_interval=security_config.audit.flush_interval_seconds
+    )
     
     # Log application startup
-    security_manager.log_security_event(
+    security_manager.emit_event(
         "application_startup",
         None,
         "127.0.0.1",
@@ -117,16 +262,11 @@ async def secure_lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down secure BioThings application")
     
-    # Stop security monitoring
-    if security_monitor.is_running:
-        await security_monitor.stop()
-    
-    # Disconnect message broker
-    if message_broker._connected:
-        await message_broker.disconnect()
+    ticker.cancel()
+    await asyncio.gather(ticker, return_exceptions=True)
     
-    # Log application shutdown
-    security_manager.log_security_event(
+    # Log application shutdown, then record everything still queued
+    security_manager.emit_event(
         "application_shutdown",
         None,
         "127.0.0.1", 
@@ -134,6 +274,22 @@ async def secure_lifespan(app: FastAPI):
         {"environment": security_config.environment.value},
         "info"
     )
+    await security_manager.stop_event_consumer()
+    
+    # Stop security monitoring
+    if security_monitor.is_running:
+        await security_monitor.stop()
+    
+    # Write any buffered audit events
+    await audit_logger.stop()
+    db_manager = get_database()
+    if db_manager:
+        db_manager.stop_audit_flusher()
+    
+    # Publish queued notifications, then disconnect message broker
+    await message_broker.stop_publisher()
+    if message_broker.is_connected:
+        await message_broker.disconnect()
     
     logger.info("Secure BioThings application shut down")
 
@@ -153,10 +309,17 @@ def create_secure_biothings_app() -> FastAPI:
         openapi_url="/openapi.json" if security_config.environment != Environment.PRODUCTION else None
     )
     
-    # Add security middleware (order is important - last added runs first)
-    app.add_middleware(SecurityMiddleware, security_manager=security_manager)
-    app.add_middleware(AuditMiddleware, audit_logger=audit_logger)
-    app.add_middleware(ValidationMiddleware, validator=input_validator)
+    # Headers attached to every error response, built once
+    security_headers = security_config.security_headers.as_headers()
+    
+    # Add security middleware: validation, audit and security checks run
+    # in that order inside a single middleware layer
+    app.add_middleware(
+        SecurityPipelineMiddleware,
+        security_manager=security_manager,
+        audit_logger=audit_logger,
+        validator=input_validator
+    )
     
     # Add CORS middleware (configured through security config)
     if security_config.cors.enabled:
@@ -178,24 +341,13 @@ def create_secure_biothings_app() -> FastAPI:
     @app.get("/")
     async def secure_root():
         """Secure root endpoint"""
-        return {
-            "name": "BioThings Secure API",
-            "version": "1.0.0",
-            "status": "operational",
-            "security": {
-                "environment": security_config.environment.value,
-                "authentication": "enabled",
-                "rate_limiting": "enabled",
-                "audit_logging": "enabled",
-                "monitoring": security_monitor.is_running
-            },
-            "features": {
-                "llm_model": llm_service.model if hasattr(llm_service, 'model') else "gemini-2.5-flash",
-                "agents_active": len(getattr(app.state, 'agents', {})),
-                "workflows_available": len(workflow_engine.protocols) if hasattr(workflow_engine, 'protocols') else 0
-            },
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        # Serialized at startup for both monitor states; only the timestamp is added here
+        payload = app.state.root_payloads[security_monitor.is_running]
+        timestamp = app.state.now_iso.encode()
+        return Response(
+            payload + b',"timestamp":"' + timestamp + b'"}',
+            media_type="application/json"
+        )
     
     # Secure health check
     @app.get("/api/health")
@@ -203,100 +355,98 @@ def create_secure_biothings_app() -> FastAPI:
         """Comprehensive health check with security status"""
         return {
             "status": "healthy",
-            "timestamp": datetime.utcnow().isoformat(),
-            "services": {
-                "message_broker": message_broker._connected,
-                "llm_service": bool(llm_service.llm),
-                "agents": len(getattr(app.state, 'agents', {})),
-                "active_experiments": len(workflow_engine.active_experiments),
-                "security_monitor": security_monitor.is_running,
-                "audit_logger": audit_logger is not None
-            },
-            "security": security_manager.get_security_summary(),
+            "timestamp": app.state.now_iso,
+            "services": app.state.health_services,
+            "security": _cached_summary("security", security_manager.get_security_summary),
             "environment": security_config.environment.value
         }
     
     # Protected agent endpoints
     @app.get("/api/agents")
-    async def get_agents(current_user: User = Depends(get_current_user)):
+    async def get_agents(
+        current_user: User = CURRENT_USER,
+        client: ClientInfo = CLIENT_INFO
+    ):
         """Get all active agents (requires authentication)"""
-        agents = getattr(app.state, 'agents', {})
+        agents = app.state.agents
         
         # Log data access
-        security_manager.log_security_event(
-            "agents_list_accessed",
-            current_user.id,
-            "127.0.0.1",  # Would get real IP from request
-            "API",
-            {"agent_count": len(agents)},
-            "info"
-        )
+        if security_manager.enabled_for("info"):
+            security_manager.emit_event(
+                "agents_list_accessed",
+                current_user.id,
+                client.ip,
+                client.user_agent,
+                {"agent_count": len(agents)},
+                "info"
+            )
         
-        return {
-            "agents": [
-                agent.get_status() for agent in agents.values()
-            ]
-        }
+        return Response(app.state.agents_status, media_type="application/json")
     
     @app.post("/api/agents/{agent_type}/task") 
     async def assign_task(
         agent_type: str, 
         task_data: Dict[str, Any],
-        current_user: User = Depends(require_scientist)  # Requires scientist role or higher
+        current_user: User = SCIENTIST,  # Requires scientist role or higher
+        client: ClientInfo = CLIENT_INFO
     ):
         """Assign a task to an agent (scientist+ access required)"""
-        agents = getattr(app.state, 'agents', {})
+        agents = app.state.agents
         agent_type = agent_type.upper()
         
         if agent_type not in agents:
             raise HTTPException(status_code=404, detail=f"Agent {agent_type} not found")
         
         agent = agents[agent_type]
+        task = task_data.get("task", "")
         result = await agent.process_task(
-            task=task_data.get("task", ""),
+            task=task,
             context=task_data.get("context", {})
         )
         
         # Log task assignment
-        security_manager.log_security_event(
-            "agent_task_assigned",
-            current_user.id,
-            "127.0.0.1",
-            "API",
-            {
-                "agent_type": agent_type,
-                "task": task_data.get("task", "")[:100],  # First 100 chars
-                "user_role": current_user.role.value
-            },
-            "info"
-        )
+        if security_manager.enabled_for("info"):
+            security_manager.emit_event(
+                "agent_task_assigned",
+                current_user.id,
+                client.ip,
+                client.user_agent,
+                {
+                    "agent_type": agent_type,
+                    "task": task[:_MAX_AUDIT_FIELD_LENGTH],  # short tasks are not copied
+                    "user_role": current_user.role.value
+                },
+                "info"
+            )
         
         return result
     
     @app.get("/api/experiments")
-    async def get_experiments(current_user: User = Depends(require_scientist)):
+    async def get_experiments(
+        current_user: User = SCIENTIST,
+        client: ClientInfo = CLIENT_INFO
+    ):
         """Get all active experiments (scientist+ access required)"""
-        experiments = [
-            await workflow_engine.get_experiment_status(exp_id)
-            for exp_id in workflow_engine.active_experiments.keys()
-        ]
+        experiments = await workflow_engine.get_experiment_statuses()
         
         # Log data access
-        security_manager.log_security_event(
-            "experiments_accessed",
-            current_user.id,
-            "127.0.0.1",
-            "API",
-            {"experiment_count": len(experiments)},
-            "info"
-        )
+        if security_manager.enabled_for("info"):
+            security_manager.emit_event(
+                "experiments_accessed",
+                current_user.id,
+                client.ip,
+                client.user_agent,
+                {"experiment_count": len(experiments)},
+                "info"
+            )
         
         return {"experiments": experiments}
     
     @app.post("/api/experiments/start")
     async def start_experiment(
         experiment_data: Dict[str, Any],
-        current_user: User = Depends(require_scientist)
+        current_user: User = SCIENTIST,
+        client: ClientInfo = CLIENT_INFO
     ):
         """Start a new experiment (scientist+ access required)"""
         try:
@@ -307,21 +457,22 @@ def create_secure_biothings_app() -> FastAPI:
             )
             
             # Log experiment creation
-            security_manager.log_security_event(
-                "experiment_started",
-                current_user.id,
-                "127.0.0.1",
-                "API",
-                {
-                    "experiment_id": experiment.id,
-                    "protocol": experiment.protocol.name,
-                    "scientist": current_user.username
-                },
-                "info"
-            )
+            if security_manager.enabled_for("info"):
+                security_manager.emit_event(
+                    "experiment_started",
+                    current_user.id,
+                    client.ip,
+                    client.user_agent,
+                    {
+                        "experiment_id": experiment.id,
+                        "protocol": experiment.protocol.name,
+                        "scientist": current_user.username
+                    },
+                    "info"
+                )
             
             # Notify other agents
-            await message_broker.publish(
+            message_broker.enqueue(
                 "experiment.started",
                 {
                     "experiment_id": experiment.id,
@@ -338,11 +489,11 @@ def create_secure_biothings_app() -> FastAPI:
             
         except Exception as e:
             # Log error
-            security_manager.log_security_event(
+            security_manager.emit_event(
                 "experiment_start_failed",
                 current_user.id,
-                "127.0.0.1",
-                "API",
+                client.ip,
+                client.user_agent,
                 {"error": str(e), "protocol": experiment_data.get("protocol")},
                 "error"
             )
@@ -351,10 +502,11 @@ def create_secure_biothings_app() -> FastAPI:
     @app.post("/api/chat")
     async def chat_with_agent(
         chat_data: Dict[str, Any],
-        current_user: User = Depends(get_current_user)
+        current_user: User = CURRENT_USER,
+        client: ClientInfo = CLIENT_INFO
     ):
         """Chat with a specific agent (requires authentication)"""
-        agents = getattr(app.state, 'agents', {})
+        agents = app.state.agents
         agent_type = chat_data.get("agent_type", "CEO").upper()
         message = chat_data.get("message", "")
         
@@ -377,21 +529,22 @@ def create_secure_biothings_app() -> FastAPI:
         )
         
         # Log chat interaction
-        security_manager.log_security_event(
-            "agent_chat_interaction",
-            current_user.id,
-            "127.0.0.1",
-            "API",
-            {
-                "agent": agent_type,
-                "message_length": len(message),
-                "response_length": len(response)
-            },
-            "info"
-        )
+        if security_manager.enabled_for("info"):
+            security_manager.emit_event(
+                "agent_chat_interaction",
+                current_user.id,
+                client.ip,
+                client.user_agent,
+                {
+                    "agent": agent_type,
+                    "message_length": len(message),
+                    "response_length": len(response)
+                },
+                "info"
+            )
         
         # Broadcast update
-        await message_broker.publish(
+        message_broker.enqueue(
             "websocket.broadcast",
             {
                 "type": "chat_response",
@@ -399,7 +552,7 @@ def create_secure_biothings_app() -> FastAPI:
                 "user": current_user.username,
                 "message": message,
                 "response": response,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": app.state.now_iso
             }
         )
         
@@ -411,26 +564,31 @@ def create_secure_biothings_app() -> FastAPI:
     
     # Admin-only endpoints
     @app.get("/api/admin/security/summary")
-    async def get_security_summary(admin_user: User = Depends(require_admin)):
+    async def get_security_summary(admin_user: User = ADMIN):
         """Get comprehensive security summary (admin only)"""
         return {
-            "security_manager": security_manager.get_security_summary(),
-            "audit_stats": audit_logger.get_statistics(),
-            "monitoring": security_monitor.get_metrics_summary(),
+            "security_manager": _cached_summary("security", security_manager.get_security_summary),
+            "audit_stats": _cached_summary("audit_stats", audit_logger.get_statistics),
+            "monitoring": _cached_summary("monitoring", security_monitor.get_metrics_summary),
             "config": security_config.get_security_summary(),
-            "threat_indicators": security_monitor.get_threat_indicators(min_score=30),
+            "threat_indicators": _cached_summary(
+                "threat_indicators", lambda: security_monitor.get_threat_indicators(min_score=30)
+            ),
             "active_alerts": security_monitor.get_active_alerts()
         }
     
     @app.post("/api/admin/security/test-alert")
-    async def test_security_alert(admin_user: User = Depends(require_admin)):
+    async def test_security_alert(
+        admin_user: User = ADMIN,
+        client: ClientInfo = CLIENT_INFO
+    ):
         """Test security alert system (admin only)"""
         # Create test alert
-        security_manager.log_security_event(
+        security_manager.emit_event(
             "test_alert",
             admin_user.id,
-            "127.0.0.1",
-            "API",
+            client.ip,
+            client.user_agent,
             {"test": True, "admin": admin_user.username},
             "warning"
         )
@@ -442,37 +600,39 @@ def create_secure_biothings_app() -> FastAPI:
     async def security_http_exception_handler(request: Request, exc: HTTPException):
         """Handle HTTP exceptions with security logging"""
         
-        # Extract user info if available
-        user_id = None
-        try:
-            # Try to get user from authorization header
+        # Log security-relevant exceptions
+        severity = "warning" if exc.status_code in [429] else "info"
+        if exc.status_code in [401, 403, 404, 429] and security_manager.enabled_for(severity):
+            # Extract user info if available; only well-formed bearer JWTs are
+            # verified, so scanners without a token never reach verify_token
+            user_id = None
             auth_header = request.headers.get("authorization")
             if auth_header and auth_header.startswith("Bearer "):
-                token = auth_header.split(" ")[1]
-                payload = security_manager.verify_token(token)
-                user_id = payload.get("sub")
-        except:
-            pass
-        
-        # Log security-relevant exceptions
-        if exc.status_code in [401, 403, 404, 429]:
-            security_manager.log_security_event(
+                token = auth_header[7:]
+                if token.count(".") == 2:
+                    try:
+                        user_id = security_manager.verify_token(token).get("sub")
+                    except (HTTPException, jwt.PyJWTError):
+                        pass
+            
+            client = request_client_info(request)
+            security_manager.emit_event(
                 f"http_{exc.status_code}",
                 user_id,
-                request.client.host,
-                request.headers.get("user-agent", ""),
+                client.ip,
+                client.user_agent,
                 {
                     "path": str(request.url.path),
                     "method": request.method,
                     "detail": exc.detail
                 },
-                "warning" if exc.status_code in [429] else "info"
+                severity
             )
         
         return JSONResponse(
             status_code=exc.status_code,
             content={"detail": exc.detail},
-            headers=security_config.security_headers.__dict__
+            headers=security_headers
         )
     
     return app
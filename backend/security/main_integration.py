@@ -16,7 +16,6 @@ import structlog
 # Import security components
 from .production_security import (
     SecurityManager, 
-    SecurityMiddleware, 
     security_manager,
     get_current_user,
     require_admin,
@@ -24,10 +23,11 @@ from .production_security import (
     User
 )
 from .auth_endpoints import auth_router
-from .validation_middleware import ValidationMiddleware, input_validator
-from .config import security_config, Environment
-from .audit_logging import audit_logger, AuditMiddleware
+from .validation_middleware import input_validator
+from .config import get_security_config, Environment
+from .audit_logging import audit_logger
 from .monitoring import security_monitor, monitoring_router
+from .pipeline_middleware import SecurityPipelineMiddleware
 
 logger = structlog.get_logger()
 
@@ -39,6 +39,7 @@ def create_secure_app(
     environment: Optional[Environment] = None
 ) -> FastAPI:
     """Create FastAPI application with comprehensive security"""
+    security_config = get_security_config()
     
     # Use provided environment or detect from config
     env = environment or security_config.environment
@@ -62,6 +63,11 @@ def create_secure_app(
         # Start security monitoring
         await security_monitor.start()
         
+        # Start background audit and security event recording
+        security_manager.set_min_severity(security_config.audit.min_severity)
+        await audit_logger.start()
+        await security_manager.start_event_consumer()
+        
         # Validate security configuration
         config_errors = security_config.validate_config()
         if config_errors and env == Environment.PRODUCTION:
@@ -78,6 +84,9 @@ def create_secure_app(
         # Stop security monitoring
         await security_monitor.stop()
         
+        # Flush remaining audit events
+        await audit_logger.stop()
+        
         # Log shutdown
         security_manager.log_security_event(
             "application_shutdown",
@@ -88,6 +97,9 @@ def create_secure_app(
             "info"
         )
         
+        # Record any security events still queued
+        await security_manager.stop_event_consumer()
+        
         logger.info("Secure BioThings application shut down")
     
     # Create FastAPI app with security settings
@@ -114,14 +126,14 @@ def create_secure_app(
         allowed_hosts=allowed_hosts
     )
     
-    # 2. Security middleware for rate limiting, IP blocking, headers
-    app.add_middleware(SecurityMiddleware, security_manager=security_manager)
-    
-    # 3. Audit logging middleware
-    app.add_middleware(AuditMiddleware, audit_logger=audit_logger)
-    
-    # 4. Input validation middleware
-    app.add_middleware(ValidationMiddleware, validator=input_validator)
+    # 2-4. Input validation, audit logging and security (rate limiting,
+    # IP blocking, headers), run in that order within one middleware layer
+    app.add_middleware(
+        SecurityPipelineMiddleware,
+        security_manager=security_manager,
+        audit_logger=audit_logger,
+        validator=input_validator
+    )
     
     # 5. Session middleware for CSRF protection
     app.add_middleware(
@@ -152,7 +164,8 @@ def create_secure_app(
         """Handle HTTP exceptions with security logging"""
         
         # Log security-relevant exceptions
-        if exc.status_code in [401, 403, 429]:
+        severity = "warning" if exc.status_code == 429 else "info"
+        if exc.status_code in [401, 403, 429] and security_manager.enabled_for(severity):
             security_manager.log_security_event(
                 f"http_{exc.status_code}",
                 None,  # User ID would be extracted from token if available
@@ -163,7 +176,7 @@ def create_secure_app(
                     "method": request.method,
                     "detail": exc.detail
                 },
-                "warning" if exc.status_code == 429 else "info"
+                severity
             )
         
         return JSONResponse(
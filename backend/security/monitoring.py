@@ -11,7 +11,7 @@ from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.responses import JSONResponse
 import structlog
 import json
-import aioredis
+import redis.asyncio as aioredis
 from statistics import mean, stdev
 
 from .production_security import require_admin, require_scientist, User, security_manager
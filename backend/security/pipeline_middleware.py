@@ -0,0 +1,36 @@
+"""
+Combined Security Middleware
+Runs input validation, audit logging and security checks in a single middleware layer
+"""
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from .production_security import SecurityManager, SecurityMiddleware
+from .audit_logging import AuditLogger, AuditMiddleware
+from .validation_middleware import InputValidator, ValidationMiddleware
+
+
+class SecurityPipelineMiddleware(BaseHTTPMiddleware):
+    """Validation, audit and security middleware fused into one layer.
+    
+    Stacking the three separately wraps every request in three
+    BaseHTTPMiddleware layers; here their dispatch methods are chained
+    directly, in the same order as when they are added individually
+    (validation outermost, security innermost).
+    """
+    
+    def __init__(self, app, security_manager: SecurityManager,
+                 audit_logger: AuditLogger, validator: InputValidator = None):
+        super().__init__(app)
+        self.security = SecurityMiddleware(app, security_manager=security_manager)
+        self.audit = AuditMiddleware(app, audit_logger=audit_logger)
+        self.validation = ValidationMiddleware(app, validator=validator)
+    
+    async def dispatch(self, request: Request, call_next):
+        async def secure(request: Request):
+            return await self.security.dispatch(request, call_next)
+        
+        async def audit(request: Request):
+            return await self.audit.dispatch(request, secure)
+        
+        return await self.validation.dispatch(request, audit)
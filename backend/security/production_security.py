@@ -3,26 +3,41 @@ Production Security Implementation for BioThings
 Implements comprehensive security measures including authentication, authorization,
 rate limiting, input validation, and security monitoring
 """
+import asyncio
 import hashlib
 import hmac
+import os
 import secrets
 import time
 import jwt
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List, Set
+from typing import Dict, Any, Optional, List, NamedTuple, Sequence, Set, Tuple
 from functools import wraps
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from enum import Enum
 
 from fastapi import Request, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, OAuth2PasswordBearer
-from fastapi.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 import bcrypt
 import structlog
 
+from app.core.batching import BatchBuffer
+
 logger = structlog.get_logger()
 
+# bcrypt releases the GIL while hashing, so a thread pool spreads password
+# work across cores without blocking the event loop
+_password_executor = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 4,
+    thread_name_prefix="password-hash"
+)
+
+# Security event severities, lowest first
+_SEVERITY_RANK = {"debug": 0, "info": 0, "warning": 1, "error": 2, "critical": 3}
+
 
 class UserRole(str, Enum):
     """User roles for RBAC"""
@@ -32,6 +47,22 @@ class UserRole(str, Enum):
     API_CLIENT = "api_client"
 
 
+class RoleBits:
+    """Bit flags for role checks on the request path"""
+    ADMIN = 1
+    SCIENTIST = 2
+    OBSERVER = 4
+    API_CLIENT = 8
+
+
+_ROLE_BITS = {
+    UserRole.ADMIN: RoleBits.ADMIN,
+    UserRole.SCIENTIST: RoleBits.SCIENTIST,
+    UserRole.OBSERVER: RoleBits.OBSERVER,
+    UserRole.API_CLIENT: RoleBits.API_CLIENT,
+}
+
+
 class SecurityLevel(str, Enum):
     """Security levels for different operations"""
     PUBLIC = "public"
@@ -40,7 +71,7 @@ class SecurityLevel(str, Enum):
     ADMIN_ONLY = "admin_only"
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     """User model"""
     id: str
@@ -52,6 +83,10 @@ class User:
     last_login: Optional[datetime] = None
     failed_login_attempts: int = 0
     account_locked_until: Optional[datetime] = None
+    role_bits: int = field(init=False, default=0)
+    
+    def __post_init__(self):
+        self.role_bits = _ROLE_BITS[self.role]
 
 
 @dataclass
@@ -73,6 +108,10 @@ class SecurityConfig:
     JWT_ALGORITHM = "HS256"
     JWT_EXPIRATION_HOURS = 24
     JWT_REFRESH_EXPIRATION_DAYS = 30
+    TOKEN_CACHE_TTL_SECONDS = 15
+    TOKEN_CACHE_MAX_SIZE = 10000
+    TOKEN_CACHE_REJECTED_TTL_SECONDS = 5
+    REFRESH_REPLAY_WINDOW_SECONDS = 2
     
     # Rate limiting
     RATE_LIMIT_REQUESTS = 100
@@ -98,6 +137,12 @@ class SecurityConfig:
     ALLOWED_ORIGINS = ["https://yourdomain.com"]
     ALLOWED_METHODS = ["GET", "POST", "PUT", "DELETE"]
     ALLOWED_HEADERS = ["Authorization", "Content-Type"]
+    
+    def __init__(self):
+        # Derived values used on the request path
+        self.jwt_expires_in_seconds = self.JWT_EXPIRATION_HOURS * 3600
+        self.jwt_refresh_expires_in_seconds = self.JWT_REFRESH_EXPIRATION_DAYS * 86400
+        self.lockout_duration = timedelta(minutes=self.LOCKOUT_DURATION_MINUTES)
 
 
 class SecurityManager:
@@ -106,13 +151,44 @@ class SecurityManager:
     def __init__(self, config: SecurityConfig = None):
         self.config = config or SecurityConfig()
         self.users: Dict[str, User] = {}
-        self.api_keys: Dict[str, Dict[str, Any]] = {}
+        self.users_by_username: Dict[str, User] = {}
+        self.users_by_email: Dict[str, User] = {}
+        self._password_hashes: Dict[str, str] = {}
+        # Keyed by api_key_digest(), so raw keys are not kept in memory
+        self.api_keys: Dict[bytes, Dict[str, Any]] = {}
         self.rate_limiters: Dict[str, List[float]] = {}
         self.blocked_ips: Set[str] = set()
         self.security_events: List[SecurityAuditEvent] = []
+        self._token_cache: Dict[bytes, Tuple[float, Dict[str, Any]]] = {}
+        self._rejected_tokens: Dict[bytes, Tuple[float, str]] = {}
+        self._refresh_replay_window: Dict[bytes, Tuple[float, Tuple[str, str]]] = {}
+        
+        # Security events emitted from request handlers are recorded by a
+        # background consumer once a batch fills up or the flush interval
+        # passes. Info events are shed when their buffer is full; warnings
+        # and above use a separate buffer and are never dropped
+        self._min_severity_rank = 0
+        self.pending_events = BatchBuffer(
+            self._flush_security_events,
+            max_size=10000,
+            batch_size=128,
+            flush_interval=1.0,
+            name="Security event consumer"
+        )
+        self.priority_events = BatchBuffer(
+            self._flush_security_events,
+            max_size=1000,
+            batch_size=128,
+            flush_interval=1.0,
+            name="Security event consumer"
+        )
         self.bearer_scheme = HTTPBearer()
         self.oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
         
+        # Verified against when a login names an unknown user, so that failed
+        # lookups cost the same bcrypt work as real ones
+        self.dummy_password_hash = self.hash_password(secrets.token_urlsafe(16))
+        
         # Initialize default admin user (change in production!)
         self._create_default_admin()
     
@@ -126,9 +202,15 @@ class SecurityManager:
             is_active=True,
             created_at=datetime.utcnow()
         )
-        self.users[admin_user.id] = admin_user
+        self.add_user(admin_user)
         logger.warning("Default admin user created - change credentials in production!")
     
+    def add_user(self, user: User):
+        """Store a user and index it by username and email"""
+        self.users[user.id] = user
+        self.users_by_username[user.username] = user
+        self.users_by_email[user.email] = user
+    
     def hash_password(self, password: str) -> str:
         """Hash password using bcrypt"""
         return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -137,6 +219,19 @@ class SecurityManager:
         """Verify password against hash"""
         return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
     
+    async def ahash_password(self, password: str) -> str:
+        """Hash password in the password worker pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_password_executor, self.hash_password, password)
+    
+    async def averify_password(self, password: str, hashed: str) -> bool:
+        """Verify password in the password worker pool"""
+        # Hand bcrypt its arguments directly; it releases the GIL while hashing
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _password_executor, bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8')
+        )
+    
     def validate_password_strength(self, password: str) -> List[str]:
         """Validate password against security requirements"""
         errors = []
@@ -160,21 +255,22 @@ class SecurityManager:
     
     def create_access_token(self, user_id: str, expires_delta: Optional[timedelta] = None) -> str:
         """Create JWT access token"""
-        if expires_delta:
-            expire = datetime.utcnow() + expires_delta
+        if expires_delta is None:
+            expires_in = self.config.jwt_expires_in_seconds
         else:
-            expire = datetime.utcnow() + timedelta(hours=self.config.JWT_EXPIRATION_HOURS)
+            expires_in = int(expires_delta.total_seconds())
         
         user = self.users.get(user_id)
         if not user:
             raise ValueError("User not found")
         
+        now = int(time.time())
         to_encode = {
             "sub": user_id,
             "username": user.username,
             "role": user.role.value,
-            "exp": expire,
-            "iat": datetime.utcnow(),
+            "exp": now + expires_in,
+            "iat": now,
             "type": "access"
         }
         
@@ -182,12 +278,11 @@ class SecurityManager:
     
     def create_refresh_token(self, user_id: str) -> str:
         """Create JWT refresh token"""
-        expire = datetime.utcnow() + timedelta(days=self.config.JWT_REFRESH_EXPIRATION_DAYS)
-        
+        now = int(time.time())
         to_encode = {
             "sub": user_id,
-            "exp": expire,
-            "iat": datetime.utcnow(),
+            "exp": now + self.config.jwt_refresh_expires_in_seconds,
+            "iat": now,
             "type": "refresh"
         }
         
@@ -195,31 +290,111 @@ class SecurityManager:
     
     def verify_token(self, token: str) -> Dict[str, Any]:
         """Verify and decode JWT token"""
+        # Serve recently verified tokens from cache until they expire or
+        # TOKEN_CACHE_TTL_SECONDS pass, whichever comes first
+        cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        now = time.monotonic()
+        cached = self._token_cache.get(cache_key)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        # Tokens that failed verification are rejected again without
+        # redoing the signature check for TOKEN_CACHE_REJECTED_TTL_SECONDS
+        rejected = self._rejected_tokens.get(cache_key)
+        if rejected and rejected[0] > now:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=rejected[1]
+            )
+        
         try:
             payload = jwt.decode(
                 token, 
                 self.config.JWT_SECRET_KEY, 
                 algorithms=[self.config.JWT_ALGORITHM]
             )
+            self._cache_token(cache_key, payload, now)
             return payload
         except jwt.ExpiredSignatureError:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token has expired"
-            )
-        except jwt.JWTError:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token"
-            )
+            detail = "Token has expired"
+        except jwt.InvalidTokenError:
+            detail = "Invalid token"
+        
+        self._cache_rejection(cache_key, detail, now)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=detail
+        )
+    
+    def _cache_token(self, cache_key: bytes, payload: Dict[str, Any], now: float):
+        """Remember a verified token payload for a short time"""
+        ttl = self.config.TOKEN_CACHE_TTL_SECONDS
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            ttl = min(ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        
+        if len(self._token_cache) >= self.config.TOKEN_CACHE_MAX_SIZE:
+            self._token_cache = {
+                key: entry for key, entry in self._token_cache.items() if entry[0] > now
+            }
+            if len(self._token_cache) >= self.config.TOKEN_CACHE_MAX_SIZE:
+                self._token_cache.clear()
+        
+        self._token_cache[cache_key] = (now + ttl, payload)
+    
+    def _cache_rejection(self, cache_key: bytes, detail: str, now: float):
+        """Remember a rejected token for a short time"""
+        if len(self._rejected_tokens) >= self.config.TOKEN_CACHE_MAX_SIZE:
+            self._rejected_tokens = {
+                key: entry for key, entry in self._rejected_tokens.items() if entry[0] > now
+            }
+            if len(self._rejected_tokens) >= self.config.TOKEN_CACHE_MAX_SIZE:
+                self._rejected_tokens.clear()
+        
+        self._rejected_tokens[cache_key] = (now + self.config.TOKEN_CACHE_REJECTED_TTL_SECONDS, detail)
+    
+    def forget_token(self, token: str):
+        """Drop any cached verification result for a token"""
+        cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        self._token_cache.pop(cache_key, None)
+        self._rejected_tokens.pop(cache_key, None)
+    
+    def get_recent_refresh(self, refresh_token: str) -> Optional[Tuple[str, str]]:
+        """Tokens issued for this refresh token within the replay window, if any"""
+        cache_key = hashlib.blake2b(refresh_token.encode(), digest_size=16).digest()
+        entry = self._refresh_replay_window.get(cache_key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+    
+    def remember_refresh(self, refresh_token: str, issued: Tuple[str, str]):
+        """Record the access/refresh pair issued for a refresh token"""
+        now = time.monotonic()
+        if len(self._refresh_replay_window) >= self.config.TOKEN_CACHE_MAX_SIZE:
+            self._refresh_replay_window = {
+                key: entry for key, entry in self._refresh_replay_window.items() if entry[0] > now
+            }
+        
+        cache_key = hashlib.blake2b(refresh_token.encode(), digest_size=16).digest()
+        self._refresh_replay_window[cache_key] = (
+            now + self.config.REFRESH_REPLAY_WINDOW_SECONDS, issued
+        )
+    
+    @staticmethod
+    def api_key_digest(api_key: str) -> bytes:
+        """Compact lookup key for an API key"""
+        return hashlib.blake2b(api_key.encode(), digest_size=16).digest()
     
     def generate_api_key(self, name: str, permissions: List[str]) -> str:
         """Generate API key"""
         api_key = secrets.token_urlsafe(self.config.API_KEY_LENGTH)
         
-        self.api_keys[api_key] = {
+        self.api_keys[self.api_key_digest(api_key)] = {
             "name": name,
             "permissions": permissions,
+            "masked": api_key[:8] + "..." + api_key[-4:],
             "created_at": datetime.utcnow(),
             "last_used": None,
             "usage_count": 0
@@ -227,9 +402,17 @@ class SecurityManager:
         
         return api_key
     
+    def get_api_key_info(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """Look up API key metadata without updating usage stats"""
+        return self.api_keys.get(self.api_key_digest(api_key))
+    
+    def revoke_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """Remove an API key, returning its metadata if it existed"""
+        return self.api_keys.pop(self.api_key_digest(api_key), None)
+    
     def verify_api_key(self, api_key: str) -> Dict[str, Any]:
         """Verify API key"""
-        key_info = self.api_keys.get(api_key)
+        key_info = self.get_api_key_info(api_key)
         if not key_info:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -293,32 +476,133 @@ class SecurityManager:
     
     def log_security_event(self, event_type: str, user_id: Optional[str], 
                           ip_address: str, user_agent: str, 
-                          details: Dict[str, Any], severity: str):
+                          details: Dict[str, Any], severity: str,
+                          timestamp: Optional[datetime] = None):
         """Log security event"""
+        if _SEVERITY_RANK.get(severity, 3) < self._min_severity_rank:
+            return
+        
         event = SecurityAuditEvent(
             event_type=event_type,
             user_id=user_id,
             ip_address=ip_address,
             user_agent=user_agent,
-            timestamp=datetime.utcnow(),
+            timestamp=timestamp or datetime.utcnow(),
             details=details,
             severity=severity
         )
         
-        self.security_events.append(event)
+        self._record_security_event(event)
+    
+    def set_min_severity(self, severity: str):
+        """Only keep security events of at least this severity"""
+        rank = _SEVERITY_RANK.get(severity.lower())
+        if rank is None:
+            # Reported by config validation; keep everything rather than fail startup
+            logger.warning("Unknown minimum security event severity", severity=severity)
+            rank = 0
+        self._min_severity_rank = rank
+    
+    def enabled_for(self, severity: str) -> bool:
+        """Whether events of this severity are kept; lets callers skip building them"""
+        return _SEVERITY_RANK.get(severity, 3) >= self._min_severity_rank
+    
+    def emit_event(self, event_type: str, user_id: Optional[str], 
+                   ip_address: str, user_agent: str, 
+                   details: Dict[str, Any], severity: str,
+                   timestamp: Optional[datetime] = None):
+        """Queue a security event for the background consumer.
+        
+        Falls back to logging inline when the consumer is not running.
+        """
+        if _SEVERITY_RANK.get(severity, 3) < self._min_severity_rank:
+            return
+        
+        if not self.pending_events.is_running:
+            self.log_security_event(
+                event_type, user_id, ip_address, user_agent, details, severity, timestamp
+            )
+            return
         
-        # Log to structured logger
-        logger.bind(
+        event = SecurityAuditEvent(
             event_type=event_type,
             user_id=user_id,
             ip_address=ip_address,
-            severity=severity,
-            details=details
-        ).info("Security event logged")
+            user_agent=user_agent,
+            timestamp=timestamp or datetime.utcnow(),
+            details=details,
+            severity=severity
+        )
+        
+        if _SEVERITY_RANK.get(severity, 3) == 0:
+            # Shed load rather than hold up the request
+            self.pending_events.put(event)
+        elif self.priority_events.is_running and not self.priority_events.is_full:
+            # Critical events are alerted on right away; everything else waits
+            # for a full batch or the flush interval
+            self.priority_events.put(event, urgent=severity == "critical")
+        else:
+            # The consumer is falling behind or stopping; record inline instead of dropping
+            self._record_security_event(event)
+    
+    @property
+    def dropped_events(self) -> int:
+        return self.pending_events.dropped + self.priority_events.dropped
+    
+    async def start_event_consumer(self, max_pending_events: Optional[int] = None,
+                                   batch_size: Optional[int] = None,
+                                   flush_interval: Optional[float] = None):
+        """Start the background security event consumer"""
+        if self.pending_events.is_running:
+            return
+        
+        if max_pending_events is not None:
+            self.pending_events.max_size = max_pending_events
+        for buffer in (self.priority_events, self.pending_events):
+            if batch_size is not None:
+                buffer.batch_size = batch_size
+            if flush_interval is not None:
+                buffer.flush_interval = flush_interval
+            await buffer.start()
+        
+        logger.info("Security event consumer started")
+    
+    async def stop_event_consumer(self):
+        """Stop the background consumer once every pending event is recorded"""
+        if not self.pending_events.is_running:
+            return
         
-        # Alert on critical events
-        if severity == "critical":
-            self._send_security_alert(event)
+        # Warnings and above first
+        await self.priority_events.stop()
+        await self.pending_events.stop()
+        
+        logger.info("Security event consumer stopped", dropped_events=self.dropped_events)
+    
+    async def _flush_security_events(self, events: Sequence[SecurityAuditEvent]):
+        """Batch handler for the event buffers"""
+        self._record_security_events(events)
+    
+    def _record_security_event(self, event: SecurityAuditEvent):
+        """Store a security event, log it and alert if critical"""
+        self._record_security_events((event,))
+    
+    def _record_security_events(self, events: Sequence[SecurityAuditEvent]):
+        """Store a batch of security events, log them and alert on critical ones"""
+        self.security_events.extend(events)
+        
+        for event in events:
+            # Log to structured logger
+            logger.bind(
+                event_type=event.event_type,
+                user_id=event.user_id,
+                ip_address=event.ip_address,
+                severity=event.severity,
+                details=event.details
+            ).info("Security event logged")
+            
+            # Alert on critical events
+            if event.severity == "critical":
+                self._send_security_alert(event)
     
     def _send_security_alert(self, event: SecurityAuditEvent):
         """Send security alert for critical events"""
@@ -351,7 +635,9 @@ class SecurityManager:
             ]),
             "failed_login_attempts": sum(
                 u.failed_login_attempts for u in self.users.values()
-            )
+            ),
+            "pending_events": len(self.pending_events) + len(self.priority_events),
+            "dropped_events": self.dropped_events
         }
 
 
@@ -426,20 +712,21 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
         
         # Log request
-        duration = time.time() - start_time
-        self.security_manager.log_security_event(
-            "http_request",
-            None,  # Would extract from token if available
-            client_ip,
-            user_agent,
-            {
-                "method": request.method,
-                "path": str(request.url.path),
-                "status_code": response.status_code,
-                "duration": duration
-            },
-            "info"
-        )
+        if self.security_manager.enabled_for("info"):
+            duration = time.time() - start_time
+            self.security_manager.log_security_event(
+                "http_request",
+                None,  # Would extract from token if available
+                client_ip,
+                user_agent,
+                {
+                    "method": request.method,
+                    "path": str(request.url.path),
+                    "status_code": response.status_code,
+                    "duration": duration
+                },
+                "info"
+            )
         
         return response
 
@@ -485,6 +772,33 @@ security_manager = SecurityManager()
 
 
 # FastAPI dependency functions
+class ClientInfo(NamedTuple):
+    """Caller address and user agent for security logging"""
+    ip: str
+    user_agent: str
+
+
+def request_client_info(request: Request) -> ClientInfo:
+    """Client details for a request, parsed once and cached on request.state"""
+    state = request.state
+    try:
+        return state.client_info
+    except AttributeError:
+        pass
+    
+    client = ClientInfo(
+        request.client.host if request.client else "",
+        request.headers.get("user-agent", "")
+    )
+    state.client_info = client
+    return client
+
+
+async def get_client_info(request: Request) -> ClientInfo:
+    """Extract client details once per request"""
+    return request_client_info(request)
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
     """Get current authenticated user"""
     try:
@@ -515,7 +829,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(H
 
 async def require_admin(current_user: User = Depends(get_current_user)):
     """Require admin role"""
-    if current_user.role != UserRole.ADMIN:
+    if not current_user.role_bits & RoleBits.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
@@ -525,7 +839,7 @@ async def require_admin(current_user: User = Depends(get_current_user)):
 
 async def require_scientist(current_user: User = Depends(get_current_user)):
     """Require scientist role or higher"""
-    if current_user.role not in [UserRole.ADMIN, UserRole.SCIENTIST]:
+    if not current_user.role_bits & (RoleBits.ADMIN | RoleBits.SCIENTIST):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Scientist access required"
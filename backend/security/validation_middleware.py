@@ -9,7 +9,7 @@ import bleach
 from typing import Dict, Any, List, Optional, Union
 from datetime import datetime
 from fastapi import Request, HTTPException, status
-from fastapi.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 import structlog
 from pydantic import BaseModel, validator
@@ -0,0 +1,106 @@
+"""
+Tests for AuditLogger background flushing
+"""
+import json
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from security.audit_logging import AuditEvent, AuditLogger, EventCategory, EventSeverity
+
+
+def make_event(index: int) -> AuditEvent:
+    return AuditEvent(
+        event_id=str(uuid.uuid4()),
+        timestamp=datetime.utcnow(),
+        event_type="http_request",
+        category=EventCategory.DATA_ACCESS,
+        severity=EventSeverity.INFO,
+        client_ip="10.0.0.1",
+        message=f"request {index}"
+    )
+
+
+def read_logged_messages(log_directory: Path):
+    messages = []
+    for path in sorted(log_directory.glob("*.jsonl")):
+        for line in path.read_text().splitlines():
+            messages.append(json.loads(line)["message"])
+    return messages
+
+
+@pytest.mark.asyncio
+async def test_stop_writes_every_queued_event(tmp_path):
+    audit_logger = AuditLogger(log_directory=str(tmp_path), real_time_alerts=False,
+                               flush_batch_size=8)
+    await audit_logger.start()
+    
+    for index in range(50):
+        assert audit_logger.enqueue_event(make_event(index))
+    await audit_logger.stop()
+    
+    assert read_logged_messages(tmp_path) == [f"request {index}" for index in range(50)]
+    assert audit_logger.get_statistics()["pending_events"] == 0
+    assert audit_logger.dropped_events == 0
+    assert not audit_logger.is_running
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_drops_and_counts(tmp_path):
+    audit_logger = AuditLogger(log_directory=str(tmp_path), real_time_alerts=False,
+                               max_pending_events=3)
+    
+    # Not started: events are rejected rather than silently queued
+    assert audit_logger.enqueue_event(make_event(0)) is False
+    
+    await audit_logger.start()
+    accepted = sum(audit_logger.enqueue_event(make_event(index)) for index in range(10))
+    await audit_logger.stop()
+    
+    assert accepted == 3
+    assert audit_logger.dropped_events == 8
+    assert len(read_logged_messages(tmp_path)) == 3
+
+
+@pytest.mark.asyncio
+async def test_log_event_writes_inline(tmp_path):
+    audit_logger = AuditLogger(log_directory=str(tmp_path), real_time_alerts=False)
+    
+    await audit_logger.log_event(make_event(1))
+    
+    assert read_logged_messages(tmp_path) == ["request 1"]
+    assert audit_logger.event_counts["http_request"] == 1
+
+
+@pytest.mark.asyncio
+async def test_successful_requests_still_trigger_suspicious_ip_alert(tmp_path):
+    audit_logger = AuditLogger(log_directory=str(tmp_path))
+    threshold = audit_logger.alert_thresholds["suspicious_ips_per_hour"]
+    
+    for index in range(threshold):
+        await audit_logger.log_event(make_event(index))
+    
+    alerts = [event for event in audit_logger.recent_events if event.event_type == "security_alert"]
+    assert alerts
+    assert alerts[0].details["alert"]["type"] == "suspicious_ip_activity"
+    assert alerts[0].details["alert"]["ips"] == ["10.0.0.1"]
+
+
+@pytest.mark.asyncio
+async def test_tracked_counters_evict_least_active_keys(tmp_path):
+    audit_logger = AuditLogger(log_directory=str(tmp_path), real_time_alerts=False)
+    audit_logger.max_tracked_keys = 4
+    
+    events = [make_event(index) for index in range(5)]
+    for index, event in enumerate(events):
+        event.user_id = f"user-{index}"
+    busy = [make_event(index) for index in range(3)]
+    for event in busy:
+        event.user_id = "user-0"
+    await audit_logger.log_events(busy + events)
+    
+    assert audit_logger.user_activity["user-0"] == 4
+    assert len(audit_logger.user_activity) == 2
+    assert audit_logger.event_counts["http_request"] == 8
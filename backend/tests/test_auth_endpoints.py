@@ -0,0 +1,95 @@
+"""
+Tests for the authentication router's user responses
+"""
+import asyncio
+import warnings
+
+import pytest
+from fastapi import HTTPException
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from security.auth_endpoints import UserCreate, auth_router, register_user
+from security.production_security import (
+    ClientInfo, get_current_user, require_admin, security_manager
+)
+
+
+@pytest.fixture
+def admin():
+    return next(user for user in security_manager.users.values() if user.role.value == "admin")
+
+
+@pytest.fixture
+def client(admin):
+    app = FastAPI()
+    app.include_router(auth_router)
+    app.dependency_overrides[get_current_user] = lambda: admin
+    app.dependency_overrides[require_admin] = lambda: admin
+    return TestClient(app)
+
+
+def test_me_returns_the_current_user(client, admin):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        response = client.get("/auth/me")
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert body["id"] == admin.id
+    assert body["username"] == admin.username
+    assert body["role"] == "admin"
+    assert set(body) == {
+        "id", "username", "email", "role", "is_active", "created_at", "last_login"
+    }
+
+
+def test_list_users_serializes_every_user(client):
+    response = client.get("/auth/users")
+    
+    assert response.status_code == 200
+    assert {user["id"] for user in response.json()} == set(security_manager.users)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_registrations_create_one_user(admin):
+    user_data = UserCreate(username="racer", email="racer@example.com", password="Str0ng!Passw0rd#")
+    client_info = ClientInfo("10.0.0.1", "test")
+    
+    try:
+        results = await asyncio.gather(
+            register_user(user_data, admin, client_info),
+            register_user(user_data, admin, client_info),
+            return_exceptions=True
+        )
+        
+        assert sum(isinstance(result, HTTPException) for result in results) == 1
+        created = [result for result in results if isinstance(result, dict)]
+        assert len(created) == 1
+        assert security_manager.users_by_username["racer"].id == created[0]["id"]
+        assert [user.id for user in security_manager.users.values() if user.username == "racer"] == [
+            created[0]["id"]
+        ]
+    finally:
+        user = security_manager.users_by_username.pop("racer", None)
+        security_manager.users_by_email.pop("racer@example.com", None)
+        if user is not None:
+            security_manager.users.pop(user.id, None)
+            security_manager._password_hashes.pop(user.id, None)
+
+
+def test_coalesced_refresh_is_still_audited(client, admin, monkeypatch):
+    events = []
+    
+    def record_event(event_type, user_id, ip_address, user_agent, details, severity):
+        events.append((event_type, details))
+    
+    monkeypatch.setattr(security_manager, "emit_event", record_event)
+    refresh_token = security_manager.create_refresh_token(admin.id)
+    
+    first = client.post("/auth/refresh", json={"refresh_token": refresh_token})
+    second = client.post("/auth/refresh", json={"refresh_token": refresh_token})
+    
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert events == [("token_refreshed", {}), ("token_refreshed", {"coalesced": True})]
@@ -0,0 +1,161 @@
+"""
+Tests for the BatchBuffer background consumer
+"""
+import asyncio
+
+import pytest
+
+from app.core.batching import BatchBuffer
+
+
+class RecordingHandler:
+    """Batch handler that records every batch it is given"""
+    
+    def __init__(self, delay: float = 0):
+        self.batches = []
+        self.delay = delay
+    
+    async def __call__(self, batch):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.batches.append(list(batch))
+    
+    @property
+    def items(self):
+        return [item for batch in self.batches for item in batch]
+
+
+@pytest.mark.asyncio
+async def test_put_is_rejected_until_started():
+    buffer = BatchBuffer(RecordingHandler(), max_size=10, batch_size=2)
+    
+    assert buffer.put("early") is False
+    assert buffer.dropped == 1
+    assert len(buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_put_is_rejected_when_full():
+    buffer = BatchBuffer(RecordingHandler(), max_size=2, batch_size=10, flush_interval=60)
+    await buffer.start()
+    
+    assert buffer.put(1) and buffer.put(2)
+    assert buffer.is_full
+    assert buffer.put(3) is False
+    assert buffer.dropped == 1
+    
+    await buffer.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_everything_in_batches():
+    handler = RecordingHandler(delay=0.01)
+    buffer = BatchBuffer(handler, max_size=100, batch_size=4)
+    await buffer.start()
+    
+    for item in range(10):
+        assert buffer.put(item)
+    await buffer.stop()
+    
+    assert handler.items == list(range(10))
+    assert all(len(batch) <= 4 for batch in handler.batches)
+    assert buffer.dropped == 0
+    assert not buffer.is_running
+
+
+@pytest.mark.asyncio
+async def test_stop_waits_for_the_batch_in_progress():
+    started = asyncio.Event()
+    release = asyncio.Event()
+    handled = []
+    
+    async def handler(batch):
+        started.set()
+        await release.wait()
+        handled.extend(batch)
+    
+    buffer = BatchBuffer(handler, max_size=100, batch_size=2)
+    await buffer.start()
+    buffer.put("a")
+    buffer.put("b")
+    buffer.put("c")
+    await started.wait()
+    
+    stopping = asyncio.create_task(buffer.stop())
+    await asyncio.sleep(0)
+    release.set()
+    await stopping
+    
+    assert handled == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_consumer_puts_its_batch_back():
+    started = asyncio.Event()
+    handled = []
+    
+    async def handler(batch):
+        if not started.is_set():
+            started.set()
+            await asyncio.sleep(60)
+        handled.extend(batch)
+    
+    buffer = BatchBuffer(handler, max_size=100, batch_size=10)
+    await buffer.start()
+    buffer.put(1)
+    buffer.put(2)
+    await started.wait()
+    
+    buffer._task.cancel()
+    await buffer.stop()
+    
+    assert handled == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_counted_and_later_batches_continue():
+    handled = []
+    
+    async def handler(batch):
+        if 0 in batch:
+            raise RuntimeError("backend unavailable")
+        handled.extend(batch)
+    
+    buffer = BatchBuffer(handler, max_size=100, batch_size=2)
+    await buffer.start()
+    for item in range(5):
+        buffer.put(item)
+    await buffer.stop()
+    
+    assert handled == [2, 3, 4]
+    assert buffer.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_flush_interval_flushes_partial_batches():
+    handler = RecordingHandler()
+    buffer = BatchBuffer(handler, max_size=100, batch_size=50, flush_interval=0.01)
+    await buffer.start()
+    
+    buffer.put("x")
+    await asyncio.sleep(0.1)
+    assert handler.items == ["x"]
+    
+    await buffer.stop()
+
+
+@pytest.mark.asyncio
+async def test_urgent_put_flushes_without_waiting_for_the_interval():
+    handler = RecordingHandler()
+    buffer = BatchBuffer(handler, max_size=100, batch_size=50, flush_interval=60)
+    await buffer.start()
+    
+    buffer.put("x")
+    await asyncio.sleep(0.05)
+    assert handler.items == []
+    
+    buffer.put("y", urgent=True)
+    await asyncio.sleep(0.05)
+    assert handler.items == ["x", "y"]
+    
+    await buffer.stop()
@@ -0,0 +1,177 @@
+"""
+Tests for DatabaseManager against a throwaway SQLite database
+"""
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from security.audit_logging import EventCategory, EventSeverity
+from security.database_models import (
+    LOCKOUT_DURATION_MINUTES, MAX_FAILED_LOGIN_ATTEMPTS, DatabaseManager, UserStatus, _epoch_ms
+)
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'security.db'}", create_tables=True)
+    yield manager
+    manager.stop_audit_flusher()
+    manager.engine.dispose()
+
+
+def audit_event_data(event_id=None, **overrides):
+    event_data = {
+        'event_id': event_id or str(uuid.uuid4()),
+        'event_type': "http_request",
+        'category': EventCategory.DATA_ACCESS,
+        'severity': EventSeverity.INFO,
+        'message': "GET /api/agents - 200",
+    }
+    event_data.update(overrides)
+    return event_data
+
+
+def stored_event_ids(db_manager):
+    return {row.event_id for row in db_manager.get_audit_events(columns=['event_id'])}
+
+
+def test_audit_events_keep_the_time_they_were_logged(db_manager):
+    db_manager._audit_flush_every = 1000
+    db_manager._audit_flush_interval = 3600
+    
+    before = datetime.utcnow()
+    db_manager.log_audit_event(audit_event_data("early"))
+    after = datetime.utcnow()
+    time.sleep(0.05)
+    db_manager.flush_audit_events()
+    
+    (timestamp,) = next(db_manager.get_audit_events(columns=['timestamp']))
+    assert before <= timestamp.replace(tzinfo=None) <= after
+
+
+def test_bad_audit_event_does_not_lose_the_batch(db_manager):
+    db_manager._audit_flush_every = 1000
+    db_manager._audit_flush_interval = 3600
+    
+    db_manager.log_audit_event(audit_event_data("first"))
+    db_manager.flush_audit_events()
+    
+    # Duplicate event_id violates the unique constraint
+    for event_id in ("second", "first", "third"):
+        db_manager.log_audit_event(audit_event_data(event_id))
+    
+    assert db_manager.flush_audit_events() == 2
+    assert db_manager.dropped_audit_events == 1
+    assert stored_event_ids(db_manager) == {"first", "second", "third"}
+
+
+def test_audit_flusher_writes_without_further_logging(db_manager):
+    db_manager._audit_flush_every = 1000
+    db_manager._audit_flush_interval = 0.05
+    db_manager.start_audit_flusher()
+    
+    db_manager.log_audit_event(audit_event_data("idle"))
+    
+    deadline = time.monotonic() + 5
+    while db_manager._audit_queue and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    assert not db_manager._audit_queue
+    db_manager.stop_audit_flusher()
+    assert stored_event_ids(db_manager) == {"idle"}
+
+
+def test_full_audit_queue_is_flushed_off_the_caller_thread(db_manager, monkeypatch):
+    db_manager._audit_flush_every = 2
+    db_manager._audit_flush_interval = 3600
+    db_manager.start_audit_flusher()
+    
+    flush_threads = []
+    flush = db_manager.flush_audit_events
+    
+    def recording_flush():
+        flush_threads.append(threading.current_thread().name)
+        return flush()
+    
+    monkeypatch.setattr(db_manager, "flush_audit_events", recording_flush)
+    
+    db_manager.log_audit_event(audit_event_data("one"))
+    time.sleep(0.05)
+    assert list(db_manager._audit_queue) and not flush_threads
+    
+    db_manager.log_audit_event(audit_event_data("two"))
+    deadline = time.monotonic() + 5
+    while db_manager._audit_queue and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    assert not db_manager._audit_queue
+    assert flush_threads == ["audit-flush"]
+    assert stored_event_ids(db_manager) == {"one", "two"}
+
+
+def create_user(db_manager, username="alice", password="Correct-Horse-1"):
+    return db_manager.create_default_admin(
+        username=username, email=f"{username}@example.com", password=password
+    )
+
+
+def test_created_user_can_read_security_fields(db_manager):
+    user = create_user(db_manager)
+    
+    assert user.is_password_in_history("Correct-Horse-1")
+    assert user.two_factor_secret is None
+
+
+@pytest.mark.parametrize("lookup", ["username", "email", "id"])
+def test_looked_up_user_can_check_password_history(db_manager, lookup):
+    created = create_user(db_manager)
+    
+    if lookup == "username":
+        user = db_manager.get_user_by_username("alice")
+    elif lookup == "email":
+        user = db_manager.get_user_by_email("alice@example.com")
+    else:
+        user = db_manager.get_user_by_id(str(created.id))
+    
+    assert user.is_password_in_history("Correct-Horse-1")
+    assert not user.is_password_in_history("Wrong-Horse-2")
+    assert user.backup_codes is None
+
+
+def failed_logins(db_manager, count, password="wrong-password"):
+    for _ in range(count):
+        assert db_manager.authenticate_user("alice", password, "10.0.0.1") is None
+
+
+def test_failed_logins_below_threshold_do_not_lock(db_manager):
+    create_user(db_manager)
+    
+    failed_logins(db_manager, MAX_FAILED_LOGIN_ATTEMPTS - 1)
+    
+    user = db_manager.get_user_by_username("alice")
+    assert user.failed_login_attempts == MAX_FAILED_LOGIN_ATTEMPTS - 1
+    assert not user.is_locked()
+    assert db_manager.authenticate_user("alice", "Correct-Horse-1", "10.0.0.1") is not None
+
+
+def test_reaching_failed_login_threshold_locks_the_account(db_manager):
+    create_user(db_manager)
+    
+    failed_logins(db_manager, MAX_FAILED_LOGIN_ATTEMPTS)
+    
+    user = db_manager.get_user_by_username("alice")
+    assert user.failed_login_attempts == MAX_FAILED_LOGIN_ATTEMPTS
+    assert user.status == UserStatus.SUSPENDED
+    assert user.is_locked()
+    remaining = user.account_locked_until.replace(tzinfo=None) - datetime.utcnow()
+    assert timedelta(minutes=LOCKOUT_DURATION_MINUTES - 1) < remaining
+    assert remaining <= timedelta(minutes=LOCKOUT_DURATION_MINUTES)
+    
+    # The right password is refused while locked and still counts as a failure
+    assert db_manager.authenticate_user("alice", "Correct-Horse-1", "10.0.0.1") is None
+    user = db_manager.get_user_by_username("alice")
+    assert user.failed_login_attempts == MAX_FAILED_LOGIN_ATTEMPTS + 1
+    assert user.account_locked_until_ts == _epoch_ms(user.account_locked_until)
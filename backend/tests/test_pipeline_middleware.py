@@ -0,0 +1,78 @@
+"""
+Tests for the fused security middleware layer
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from security.audit_logging import AuditLogger, AuditMiddleware
+from security.pipeline_middleware import SecurityPipelineMiddleware
+from security.production_security import SecurityManager, SecurityMiddleware
+from security.validation_middleware import ValidationMiddleware
+
+
+@pytest.fixture
+def audit_logger(tmp_path):
+    return AuditLogger(log_directory=str(tmp_path), real_time_alerts=False)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record entry into and exit from each fused middleware's dispatch"""
+    calls = []
+    
+    def recording(name, dispatch):
+        async def recorded_dispatch(self, request, call_next):
+            calls.append(f"enter {name}")
+            response = await dispatch(self, request, call_next)
+            calls.append(f"exit {name}")
+            return response
+        return recorded_dispatch
+    
+    for name, middleware in [("validation", ValidationMiddleware),
+                             ("audit", AuditMiddleware),
+                             ("security", SecurityMiddleware)]:
+        monkeypatch.setattr(middleware, "dispatch", recording(name, middleware.dispatch))
+    return calls
+
+
+@pytest.fixture
+def client(audit_logger, calls):
+    app = FastAPI()
+    app.add_middleware(SecurityPipelineMiddleware,
+                       security_manager=SecurityManager(),
+                       audit_logger=audit_logger)
+    
+    @app.get("/ping")
+    async def ping():
+        calls.append("endpoint")
+        return {"status": "ok"}
+    
+    return TestClient(app)
+
+
+def test_middlewares_run_validation_audit_security_in_order(client, calls):
+    response = client.get("/ping")
+    
+    assert response.status_code == 200
+    assert calls == [
+        "enter validation",
+        "enter audit",
+        "enter security",
+        "endpoint",
+        "exit security",
+        "exit audit",
+        "exit validation",
+    ]
+
+
+def test_each_middleware_still_applies(client, audit_logger):
+    response = client.get("/ping")
+    
+    # Security headers from the innermost layer
+    assert response.headers["X-Frame-Options"] == "DENY"
+    
+    # Audit layer saw the request (logged inline since the logger is not started)
+    assert [(event.event_type, event.endpoint) for event in audit_logger.recent_events] == [
+        ("http_request", "/ping")
+    ]
@@ -0,0 +1,97 @@
+"""
+Tests for SecurityManager token verification
+"""
+import pytest
+from fastapi import HTTPException
+
+import security.production_security as production_security
+from security.production_security import SecurityManager
+
+
+@pytest.fixture
+def manager():
+    return SecurityManager()
+
+
+@pytest.fixture
+def decode_calls(monkeypatch):
+    """Count signature checks done by jwt.decode"""
+    calls = []
+    decode = production_security.jwt.decode
+    
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+    
+    monkeypatch.setattr(production_security.jwt, "decode", counting_decode)
+    return calls
+
+
+def test_valid_token_is_served_from_cache(manager, decode_calls):
+    user_id = next(iter(manager.users))
+    token = manager.create_access_token(user_id)
+    
+    assert manager.verify_token(token)["sub"] == user_id
+    assert manager.verify_token(token)["sub"] == user_id
+    assert len(decode_calls) == 1
+
+
+@pytest.mark.parametrize("token", ["not-a-token", "a.b.c"])
+def test_malformed_token_is_rejected_with_401(manager, token):
+    with pytest.raises(HTTPException) as exc_info:
+        manager.verify_token(token)
+    
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.detail == "Invalid token"
+
+
+def test_repeated_bad_token_hits_rejection_cache(manager, decode_calls):
+    user_id = next(iter(manager.users))
+    token = manager.create_access_token(user_id)[:-4] + "AAAA"
+    
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc_info:
+            manager.verify_token(token)
+        assert exc_info.value.status_code == 401
+        assert exc_info.value.detail == "Invalid token"
+    
+    assert decode_calls == [token]
+
+
+def test_forget_token_drops_cached_payload(manager, decode_calls):
+    user_id = next(iter(manager.users))
+    token = manager.create_access_token(user_id)
+    
+    manager.verify_token(token)
+    manager.forget_token(token)
+    manager.verify_token(token)
+    assert len(decode_calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_stop_event_consumer_records_every_pending_event(manager):
+    recorded_before = len(manager.security_events)
+    await manager.start_event_consumer(max_pending_events=5, batch_size=2, flush_interval=60)
+    
+    for index in range(8):
+        manager.emit_event("http_404", None, "10.0.0.1", "test", {"n": index}, "info")
+    for index in range(3):
+        manager.emit_event("http_429", None, "10.0.0.1", "test", {"n": index}, "warning")
+    await manager.stop_event_consumer()
+    
+    recorded = list(manager.security_events)[recorded_before:]
+    assert [event.event_type for event in recorded].count("http_429") == 3
+    assert [event.event_type for event in recorded].count("http_404") == 5
+    assert manager.dropped_events == 3
+    assert manager.get_security_summary()["pending_events"] == 0
+
+
+@pytest.mark.parametrize("severity, kept", [
+    ("WARNING", ["warning", "critical"]),
+    ("debug", ["info", "warning", "critical"]),
+    ("verbose", ["info", "warning", "critical"]),
+])
+def test_set_min_severity_normalizes_configured_values(manager, severity, kept):
+    manager.set_min_severity(severity)
+    
+    assert [s for s in ("info", "warning", "critical") if manager.enabled_for(s)] == kept